@@ -0,0 +1,119 @@
+"""
+    daqtasks.py
+    -----------
+    Bookkeeping of the tasks of a DAQ card, shared by the real card (see ni6251.py) and the simulated one
+    (see simulated.py). The tasks are kept by number, and the analog tasks that are stopped are kept configured
+    for restarting them when the same configuration is needed again.
+"""
+import numpy as np
+from collections import OrderedDict
+
+
+class daqTasks():
+    """Tasks of a card. The cards only have to define how a task is stopped and how its resources are freed,
+    see stopTask and releaseTask.
+    """
+    def __init__(self):
+        self.tasks = {} # Dictionary to hold the tasks by their number. Each element should be a dict
+        self.taskCount = 0 # Number given to the next task
+        self.cache = OrderedDict() # Configured tasks that can be restarted, by their configuration
+        self.maxCached = 8 # Maximum number of tasks kept configured
+        self.bufferMargin = 2 # Buffers of continuous tasks hold this many refresh intervals
+
+    def addTask(self,task):
+        """Adds a task to the list of tasks.
+        task -- Dictionary containing name and TaskHandle of the task.
+        """
+        number = self.taskCount
+        self.taskCount += 1
+        self.tasks[number] = task
+        self.tasks[number]['alive'] = 1
+        return number
+
+    def getTask(self,number):
+        """Retrieves the task based on the number.
+        """
+        number = int(number)
+        return self.tasks[number]
+
+    def cachedTask(self,key):
+        """Returns the number of a stopped task configured as specified by key, or None if there is none.
+        The task is marked as alive.
+        """
+        number = self.cache.get(key)
+        if number is None or self.tasks[number]['alive']:
+            return None
+        self.cache.move_to_end(key)
+        self.tasks[number]['alive'] = 1
+        return number
+
+    def cacheTask(self,key,number):
+        """Keeps the task configured for reusing it. If there are more than maxCached tasks,
+        the stopped tasks that were used the longest time ago are released.
+        If a task with the same configuration is already cached, i.e. it is still running, this one is not cached
+        and it is released when it is cleared.
+        """
+        if key in self.cache:
+            return
+        self.tasks[number]['key'] = key
+        self.cache[key] = number
+        for k in list(self.cache.keys()):
+            if len(self.cache) <= self.maxCached:
+                break
+            if not self.tasks[self.cache[k]]['alive']:
+                self.release(self.cache[k])
+
+    def release(self,tasks):
+        """Clears the specified tasks, releasing all the resources, and forgets them.
+        tasks -- list of tasks to release
+        """
+        if type(tasks) != type([]):
+            tasks = [tasks]
+        for task in tasks:
+            t = self.tasks.pop(int(task))
+            if 'key' in t and self.cache.get(t['key']) == int(task):
+                del self.cache[t['key']]
+            self.releaseTask(t)
+
+    def releaseAll(self):
+        """Releases all the tasks.
+        """
+        self.release(list(self.tasks.keys()))
+
+    def makeBuffer(self,channels,accuracy,refresh):
+        """Allocates the buffer of a continuous task.
+        It is big enough to hold bufferMargin refresh intervals of all the channels.
+        channels -- number of channels of the task
+        accuracy -- the time between acquisitions (in seconds)
+        refresh -- the expected time between reads (in seconds)
+        """
+        points = int(np.ceil(refresh/accuracy*self.bufferMargin))
+        return np.zeros((max(points,1)*channels,), dtype=np.float64)
+
+    def clear(self,tasks):
+        """Stops the specified task. It is kept configured so that analogSetup can reuse it,
+        use release for freeing its resources.
+        task -- list of tasks to clear
+        """
+        if type(tasks) != type([]):
+            tasks = [tasks]
+        for task in tasks:
+            if int(task) in self.tasks:
+                if 'key' not in self.getTask(task):
+                    # Tasks that are not cached, like the analog outputs, are released
+                    self.release(task)
+                    continue
+                self.stopTask(self.getTask(task))
+                self.getTask(task)['alive'] = 0
+
+    def stopTask(self,task):
+        """Stops a task of the card, keeping it configured. Defined by every card.
+        task -- the dictionary of the task.
+        """
+        pass
+
+    def releaseTask(self,task):
+        """Frees the resources of a task of the card. Defined by every card.
+        task -- the dictionary of the task, already removed from the list of tasks.
+        """
+        pass
@@ -7,34 +7,22 @@ from PyDAQmx import *
 import PyDAQmx as nidaq
 import numpy as np
 
+from Controller.devices.daqtasks import daqTasks
 
-class niDAQ():
+
+class niDAQ(daqTasks):
     """Class for controlling a National Instruments NI-6251 DAQ.
     If using an expansion such as the SCC-68 it has to be properly configured through the NI-MAX software.
     """
     def __init__(self,device_number=1,model='6251',debug=0):
+        daqTasks.__init__(self)
         self.read = int32()
         if debug == 1:
             print('Not implemented a debuggable version')
         else:
             self.adq = nidaq
-        self.tasks = [] # Array to hold the tasks. Each element should be a dict
         self.deviceNumber = int(device_number)
 
-    def addTask(self,task):
-        """Adds a task to the list of tasks.
-        task -- Dictionary containing name and TaskHandle of the task.
-        """
-        self.tasks.append(task)
-        self.tasks[-1]['alive'] = 1
-        return self.tasks.__len__()-1
-
-    def getTask(self,number):
-        """Retrieves the task based on the number.
-        """
-        number = int(number)
-        return self.tasks[number]
-
     def acquire_analog(self,channel,points,accuracy,limits=(-10.0,10.0)):
         """Acquires an analog signal in the specified channel. The execution blocks the rest of the program.
         channel --  has to be defined as "Dev1/ai0", for example.
@@ -57,36 +45,51 @@ class niDAQ():
         # DAQmx Start Code
         DAQmxStartTask(self.task_Analog)
         DAQmxReadAnalogF64(self.task_Analog,points,waiting_time,DAQmx_Val_GroupByChannel,data,points,byref(self.read),None)
-        self.tasks[taskAnalogNumber]['alive'] = 0
+        self.release(taskAnalogNumber)
         return data
 
-    def analogSetup(self,taskNum,channel,points,accuracy,limits=(-10.0,10.0)):
+    def analogSetup(self,taskNum,channel,points,accuracy,limits=(-10.0,10.0),refresh=None):
         """Prepares the task for an analog measurement.
         taskNum -- the number of the task (an integer)
         channel --  has to be defined as 1 or as [1,2], for example, meaning ai1, ai2, etc.
         points -- the total number of points to be acquired
         accuracy -- the time between acquisitions (in seconds)
-        limits -- the limits of the expected values. A tuple of 2 values.
+        limits -- the limits of the expected values. A tuple of 2 values, or a list of tuples with one tuple per channel.
+        refresh -- only for continuous measurements, the expected time between reads (in seconds). If given, the task
+                   gets a buffer that is reused in every read (see analogRead).
+        A task with the same configuration that was stopped with clear is reused instead of creating a new one.
         """
-        taskAnalogNumber = self.addTask({'name':'TaskAnalog','TaskHandle':TaskHandle(taskNum)})
-        self.task_Analog = self.getTask(taskAnalogNumber)['TaskHandle']
         points = int(points)
         dev = 'Dev%s'%self.deviceNumber
         if type(channel) != type([]):
             channel = [channel]
-        channels = []
-        for c in channel:
-            newChannel = '%s/ai%s'%(dev,int(c))
-            channels.append(newChannel)
-        channels = ', '.join(channels)
-        channels = str.encode(channels)
+        if type(limits) != type([]):
+            limits = [limits]*len(channel)
+        if len(limits) != len(channel):
+            raise Exception('The number of limits does not match the number of channels')
+        key = (tuple(int(c) for c in channel),float(accuracy),points,tuple((float(l[0]),float(l[1])) for l in limits),refresh)
+        taskAnalogNumber = self.cachedTask(key)
+        if taskAnalogNumber is not None:
+            return taskAnalogNumber
+        taskAnalogNumber = self.addTask({'name':'TaskAnalog','TaskHandle':TaskHandle(taskNum)})
+        self.task_Analog = self.getTask(taskAnalogNumber)['TaskHandle']
         freq = 1/accuracy # Accuracy in seconds
         DAQmxCreateTask("",byref(self.task_Analog))
-        DAQmxCreateAIVoltageChan(self.task_Analog,channels,None,DAQmx_Val_RSE,limits[0],limits[1],DAQmx_Val_Volts,None)
+        # Each channel is added separately to the same task in order to keep its own limits.
+        names = []
+        for c,l in zip(channel,limits):
+            names.append(str.encode('%s/ai%s'%(dev,int(c))))
+            DAQmxCreateAIVoltageChan(self.task_Analog,names[-1],None,DAQmx_Val_RSE,l[0],l[1],DAQmx_Val_Volts,None)
+        self.tasks[taskAnalogNumber]['channels'] = len(channel)
+        self.tasks[taskAnalogNumber]['points'] = points
+        self.tasks[taskAnalogNumber]['channelNames'] = names
+        if points<=0 and refresh is not None:
+            self.tasks[taskAnalogNumber]['buffer'] = self.makeBuffer(len(channel),accuracy,refresh)
         if points>0:
             DAQmxCfgSampClkTiming(self.task_Analog,"",freq,DAQmx_Val_Rising,DAQmx_Val_FiniteSamps,points)
         else:
             DAQmxCfgSampClkTiming(self.task_Analog,"",freq,DAQmx_Val_Rising,DAQmx_Val_ContSamps,points)
+        self.cacheTask(key,taskAnalogNumber)
         return taskAnalogNumber
 
     def analogTrigger(self,taskNumber):
@@ -99,9 +102,16 @@ class niDAQ():
             # DAQmx Start Code
             DAQmxStartTask(self.task_Analog)
 
-    def analogRead(self,taskNumber,points,waiting=1):
+    def analogRead(self,taskNumber,points,waiting=1,out=None):
         """Reads a number of points from the analog task.
+        points -- the number of points per channel to be read. If 0 or less, all the points of a finite task, waiting
+                  for them, or the points available of a continuous task.
+        out -- optional numpy array of float64 with at least points*channels elements, where to store the data
+               when reading a fixed number of points from a task without its own buffer.
         Returns the total number of data points per channel acquired and a numpy array of length values*channels.
+        The array is grouped by channel, i.e. all the points of the first channel come before the ones of the second.
+        If the task has its own buffer (see analogSetup), the array is a view of it and is overwritten by the next read.
+        In that case the samples that do not fit in the buffer are left in the card for the next read.
         """
         self.task_Analog = self.getTask(taskNumber)['TaskHandle']
         if type(self.task_Analog) != type(TaskHandle()):
@@ -109,23 +119,129 @@ class niDAQ():
         else:
             self.read = int32()
             points = int(points)
-            if points>0:
-                data = np.zeros((points,), dtype=np.float64)
-                DAQmxReadAnalogF64(self.task_Analog,points,waiting,DAQmx_Val_GroupByChannel,data,points,byref(self.read),None)
+            channels = self.getTask(taskNumber).get('channels',1)
+            if 'buffer' in self.getTask(taskNumber):
+                data = self.getTask(taskNumber)['buffer']
+                if points>0:
+                    toRead = min(points,int(len(data)/channels))
+                else:
+                    available = uInt32()
+                    DAQmxGetReadAvailSampPerChan(self.task_Analog,byref(available))
+                    toRead = min(available.value,int(len(data)/channels))
+                    waiting = .2
+                if toRead == 0:
+                    return 0,data[:0]
+                DAQmxReadAnalogF64(self.task_Analog,toRead,waiting,DAQmx_Val_GroupByChannel,data,len(data),byref(self.read),None)
+                return self.read.value,data[:self.read.value*channels]
+            elif points>0:
+                if out is not None:
+                    data = out[:points*channels]
+                else:
+                    data = np.zeros((points*channels,), dtype=np.float64)
+                DAQmxReadAnalogF64(self.task_Analog,points,waiting,DAQmx_Val_GroupByChannel,data,points*channels,byref(self.read),None)
+            elif self.getTask(taskNumber).get('points',0)>0:
+                # The array is sized for all the points of the finite task
+                data = np.zeros((self.getTask(taskNumber)['points']*channels,), dtype=np.float64)
+                DAQmxReadAnalogF64(self.task_Analog,-1,waiting,DAQmx_Val_GroupByChannel,data,len(data),byref(self.read),None)
             else:
-                data = np.zeros((10000,), dtype=np.float64) # Defining a 10000 value that is completely arbitrary
-                DAQmxReadAnalogF64(self.task_Analog,points,.2,DAQmx_Val_GroupByChannel,data,points,byref(self.read),None)
+                # The array is sized for the points already acquired by the continuous task
+                available = uInt32()
+                DAQmxGetReadAvailSampPerChan(self.task_Analog,byref(available))
+                data = np.zeros((available.value*channels,), dtype=np.float64)
+                if available.value == 0:
+                    return 0,data
+                DAQmxReadAnalogF64(self.task_Analog,available.value,.2,DAQmx_Val_GroupByChannel,data,len(data),byref(self.read),None)
             values = self.read.value
             return values,data
 
-    def clear(self,tasks):
-        """Clears the specified task, releasing all the resources.
-        task -- list of tasks to clear
+    def aiClock(self):
+        """Returns the terminal of the sample clock of the analog inputs, for synchronizing other tasks to it.
+        """
+        return str.encode('/Dev%s/ai/SampleClock'%self.deviceNumber)
+
+    def analogOutputSetup(self,taskNum,channel,points,accuracy,limits=(0.0,10.0),clock=None):
+        """Prepares a buffered analog output task. The waveform has to be written with analogWrite before triggering it.
+        taskNum -- the number of the task (an integer)
+        channel --  has to be defined as 0 or as [0,1], for example, meaning ao0, ao1, etc.
+        points -- the number of points of the waveform of each channel
+        accuracy -- the time between points (in seconds)
+        limits -- the limits of the output values. A tuple of 2 values.
+        clock -- the terminal of the sample clock. If None the own clock of the outputs is used.
+                 With aiClock() the outputs are updated on the same clock as the analog inputs;
+                 in that case the output has to be triggered before the input.
+        """
+        taskNumber = self.addTask({'name':'TaskAnalogOutput','TaskHandle':TaskHandle(taskNum)})
+        task = self.getTask(taskNumber)['TaskHandle']
+        dev = 'Dev%s'%self.deviceNumber
+        if type(channel) != type([]):
+            channel = [channel]
+        points = int(points)
+        freq = 1/accuracy # Accuracy in seconds
+        DAQmxCreateTask("",byref(task))
+        for c in channel:
+            newChannel = str.encode('%s/ao%s'%(dev,int(c)))
+            DAQmxCreateAOVoltageChan(task,newChannel,None,limits[0],limits[1],DAQmx_Val_Volts,None)
+        if clock is None:
+            clock = ""
+        DAQmxCfgSampClkTiming(task,clock,freq,DAQmx_Val_Rising,DAQmx_Val_FiniteSamps,points)
+        self.tasks[taskNumber]['channels'] = len(channel)
+        return taskNumber
+
+    def analogWrite(self,taskNumber,data,waiting=10):
+        """Writes the waveform of an analog output task. It does not start the task.
+        data -- numpy array of shape (channels, points) with the values in volts.
+        Returns the number of points per channel written.
+        """
+        task = self.getTask(taskNumber)['TaskHandle']
+        data = np.ascontiguousarray(data,dtype=np.float64)
+        written = int32()
+        DAQmxWriteAnalogF64(task,data.shape[-1],0,waiting,DAQmx_Val_GroupByChannel,data,byref(written),None)
+        return written.value
+
+    def analogReadBinary(self,taskNumber,points,waiting=1):
+        """Reads a number of points from the analog task as the raw integers of the card, without scaling them to volts.
+        It takes a quarter of the memory of analogRead. Use scalingCoefficients for converting the values to volts.
+        points -- the number of points per channel to be read. If 0 or less, reads the points available.
+        Returns the total number of data points per channel acquired and a numpy array of int16 of length values*channels,
+        grouped by channel.
+        """
+        self.task_Analog = self.getTask(taskNumber)['TaskHandle']
+        if type(self.task_Analog) != type(TaskHandle()):
+            raise Exception('Reading an analog measurement before defining it')
+        self.read = int32()
+        points = int(points)
+        channels = self.getTask(taskNumber).get('channels',1)
+        if points<=0:
+            available = uInt32()
+            DAQmxGetReadAvailSampPerChan(self.task_Analog,byref(available))
+            points = available.value
+            waiting = .2
+        data = np.zeros((points*channels,), dtype=np.int16)
+        if points == 0:
+            return 0,data
+        DAQmxReadBinaryI16(self.task_Analog,points,waiting,DAQmx_Val_GroupByChannel,data,len(data),byref(self.read),None)
+        return self.read.value,data[:self.read.value*channels]
+
+    def scalingCoefficients(self,taskNumber,ncoeffs=4):
+        """Returns the polynomial that converts the raw values of every channel of the task to volts.
+        ncoeffs -- number of coefficients of the polynomial.
+        Returns a numpy array of shape (channels, ncoeffs), with the coefficients in increasing order.
+        """
+        task = self.getTask(taskNumber)
+        coeffs = np.zeros((task['channels'],ncoeffs), dtype=np.float64)
+        for i,name in enumerate(task['channelNames']):
+            DAQmxGetAIDevScalingCoeff(task['TaskHandle'],name,coeffs[i],ncoeffs)
+        return coeffs
+
+    def stopTask(self,task):
+        """Stops a task of the card, keeping it configured.
+        """
+        self.adq.DAQmxStopTask(task['TaskHandle'])
+
+    def releaseTask(self,task):
+        """Clears a task of the card, freeing its resources.
         """
-        if type(tasks) != type([]):
-            tasks = [tasks]
-        for task in tasks:
-            self.adq.DAQmxClearTask(self.getTask(task)['TaskHandle'])
+        self.adq.DAQmxClearTask(task['TaskHandle'])
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
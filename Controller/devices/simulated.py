@@ -0,0 +1,303 @@
+"""
+    simulated.py
+    ------------
+    Software replacement for the NI DAQ. It exposes the same functions as niDAQ (see ni6251.py) but instead of
+    communicating with a card it generates, in real time, the signals that a QPD would give for a bead in an optical trap.
+    Useful for testing and benchmarking the acquisition and analysis chain in computers without the card.
+"""
+import time
+import numpy as np
+
+from Controller.devices.daqtasks import daqTasks
+
+
+def ornsteinUhlenbeck(x0,a,sigma,points,rng):
+    """Generates the exact discretization of an Ornstein-Uhlenbeck process, x[n] = a*x[n-1] + sigma*e[n].
+    x0 -- numpy array with the last value of each channel.
+    a -- numpy array with the decay factor per sample of each channel, exp(-2*pi*fc*dt).
+    sigma -- numpy array with the standard deviation of the random kick of each channel.
+    points -- number of points to generate per channel.
+    rng -- numpy.random.RandomState used for the random kicks.
+    Returns a numpy array of shape (channels, points).
+    """
+    channels = len(x0)
+    data = np.empty((channels,points))
+    e = rng.standard_normal((channels,points))
+    x = np.array(x0,dtype=np.float64)
+    # The recursion is solved in closed form with a cumulative sum. It is done in chunks in order to avoid
+    # that the powers of a overflow.
+    chunk = max(1,int(50/np.max(-np.log(a))))
+    for start in range(0,points,chunk):
+        end = min(start+chunk,points)
+        pw = a[:,np.newaxis]**np.arange(1,end-start+1)
+        data[:,start:end] = pw*(x[:,np.newaxis]+np.cumsum(sigma[:,np.newaxis]*e[:,start:end]/pw,axis=1))
+        x = data[:,end-1]
+    return data
+
+
+class simDAQ(daqTasks):
+    """Simulated DAQ with the same interface as niDAQ.
+    Every analog channel gives the position of a trapped bead, modelled as an Ornstein-Uhlenbeck process,
+    plus white noise from the detector and a pickup at the frequency of the mains.
+    The parameters of every channel can be changed with configureChannel.
+    """
+    def __init__(self,device_number=1,model='sim',debug=0,seed=None):
+        daqTasks.__init__(self)
+        self.deviceNumber = int(device_number)
+        self.model = model
+        self.maxRate = 1e6 # Maximum aggregate sampling rate, in samples per second
+        self.rng = np.random.RandomState(seed)
+        # Default parameters for all the channels
+        self.defaults = {'fc':500., # Corner frequency in Hz
+                         'D':30., # Diffusion constant in V^2/s
+                         'offset':0., # Offset of the signal in V
+                         'noise':1e-3, # Standard deviation of the detector noise in V
+                         'pickup':5e-3, # Amplitude of the pickup in V
+                         'pickupFreq':50.} # Frequency of the pickup in Hz
+        self.channels = {}
+
+    def configureChannel(self,channel,**kwargs):
+        """Changes the parameters of the signal generated in the channel.
+        channel -- the number of the channel, 1 meaning ai1.
+        kwargs -- any of fc, D, offset, noise, pickup or pickupFreq.
+        """
+        channel = int(channel)
+        for k in kwargs:
+            if k not in self.defaults:
+                raise Exception('Parameter %s not known by the simulated DAQ'%k)
+        params = self.channels.get(channel,dict(self.defaults))
+        params.update(kwargs)
+        self.channels[channel] = params
+        # The stopped tasks were configured with the old parameters
+        self.release([self.cache[k] for k in self.cache if not self.tasks[self.cache[k]]['alive']])
+
+    def getChannel(self,channel):
+        """Returns the parameters of the specified channel.
+        """
+        return self.channels.get(int(channel),self.defaults)
+
+    def acquire_analog(self,channel,points,accuracy,limits=(-10.0,10.0)):
+        """Acquires an analog signal in the specified channel. The execution blocks the rest of the program.
+        channel --  has to be defined as "Dev1/ai0", for example.
+        points -- the total number of points to be acquired
+        accuracy -- the time between acquisitions (in seconds)
+        limits -- the limits of the expected values. A tuple of 2 values.
+        Returns: numpy array of length points
+        """
+        channel = int(channel.split('ai')[-1])
+        taskAnalogNumber = self.analogSetup(0,channel,points,accuracy,limits)
+        self.analogTrigger(taskAnalogNumber)
+        v,data = self.analogRead(taskAnalogNumber,points,points*accuracy*1.05)
+        self.release(taskAnalogNumber)
+        return data
+
+    def analogSetup(self,taskNum,channel,points,accuracy,limits=(-10.0,10.0),refresh=None):
+        """Prepares the task for an analog measurement.
+        taskNum -- the number of the task (an integer)
+        channel --  has to be defined as 1 or as [1,2], for example, meaning ai1, ai2, etc.
+        points -- the total number of points to be acquired
+        accuracy -- the time between acquisitions (in seconds)
+        limits -- the limits of the expected values. A tuple of 2 values, or a list of tuples with one tuple per channel.
+        refresh -- only for continuous measurements, the expected time between reads (in seconds). If given, the task
+                   gets a buffer that is reused in every read (see analogRead).
+        A task with the same configuration that was stopped with clear is reused instead of creating a new one.
+        """
+        if type(channel) != type([]):
+            channel = [channel]
+        if type(limits) != type([]):
+            limits = [limits]*len(channel)
+        if len(limits) != len(channel):
+            raise Exception('The number of limits does not match the number of channels')
+        key = (tuple(int(c) for c in channel),float(accuracy),int(points),tuple((float(l[0]),float(l[1])) for l in limits),refresh)
+        taskAnalogNumber = self.cachedTask(key)
+        if taskAnalogNumber is not None:
+            return taskAnalogNumber
+        freq = 1/accuracy # Accuracy in seconds
+        if freq*len(channel) > self.maxRate:
+            raise Exception('Sampling rate of %s S/s exceeds the maximum of the card'%(freq*len(channel)))
+        params = [self.getChannel(c) for c in channel]
+        fc = np.array([p['fc'] for p in params])
+        D = np.array([p['D'] for p in params])
+        a = np.exp(-2*np.pi*fc*accuracy)
+        task = {'name':'TaskAnalog',
+                'TaskHandle':taskNum,
+                'channels':len(channel),
+                'points':int(points),
+                'accuracy':accuracy,
+                'limits':np.array(limits,dtype=np.float64),
+                'params':params,
+                'a':a,
+                'sigma':np.sqrt(D/(2*np.pi*fc)*(1-a**2)),
+                # Start from the stationary distribution
+                'x':self.rng.standard_normal(len(channel))*np.sqrt(D/(2*np.pi*fc)),
+                'phase':self.rng.uniform(0,2*np.pi,len(channel)),
+                'generated':0,
+                'started':None}
+        if int(points)<=0 and refresh is not None:
+            task['buffer'] = self.makeBuffer(len(channel),accuracy,refresh)
+        taskAnalogNumber = self.addTask(task)
+        self.cacheTask(key,taskAnalogNumber)
+        return taskAnalogNumber
+
+    def analogTrigger(self,taskNumber):
+        """Triggers the analog measurement.
+        """
+        task = self.getTask(taskNumber)
+        task['started'] = time.time()
+        task['generated'] = 0
+
+    def generate(self,task,points):
+        """Generates the next points of every channel of the task.
+        Returns a numpy array of shape (channels, points).
+        """
+        params = task['params']
+        if points == 0:
+            return np.zeros((task['channels'],0))
+        data = ornsteinUhlenbeck(task['x'],task['a'],task['sigma'],points,self.rng)
+        task['x'] = data[:,-1].copy()
+        t = (task['generated']+np.arange(points))*task['accuracy']
+        for i,p in enumerate(params):
+            data[i] += p['offset']
+            data[i] += p['pickup']*np.sin(2*np.pi*p['pickupFreq']*t+task['phase'][i])
+        data += np.array([p['noise'] for p in params])[:,np.newaxis]*self.rng.standard_normal(data.shape)
+        np.clip(data,task['limits'][:,0:1],task['limits'][:,1:2],out=data)
+        task['generated'] += points
+        return data
+
+    def analogRead(self,taskNumber,points,waiting=1,out=None):
+        """Reads a number of points from the analog task.
+        points -- the number of points per channel to be read. If 0 or less, all the points of a finite task, waiting
+                  for them, or the points available of a continuous task.
+        out -- optional numpy array of float64 with at least points*channels elements, where to store the data
+               when reading a fixed number of points from a task without its own buffer.
+        Returns the total number of data points per channel acquired and a numpy array of length values*channels.
+        The array is grouped by channel, i.e. all the points of the first channel come before the ones of the second.
+        If the task has its own buffer (see analogSetup), the array is a view of it and is overwritten by the next read.
+        In that case the samples that do not fit in the buffer are left in the card for the next read.
+        """
+        task = self.getTask(taskNumber)
+        if task['started'] is None:
+            raise Exception('Reading an analog measurement before defining it')
+        points = int(points)
+        channels = task['channels']
+        available = int((time.time()-task['started'])/task['accuracy'])-task['generated']
+        if points<=0 and task['points']>0 and 'buffer' not in task:
+            # All the points of a finite task, waiting for them
+            points = task['points']-task['generated']
+        if points>0:
+            if task['points']>0:
+                points = min(points,task['points']-task['generated'])
+            if 'buffer' in task:
+                points = min(points,int(len(task['buffer'])/channels))
+            # Wait until the card would have acquired the points
+            remaining = (points-available)*task['accuracy']
+            if remaining>waiting:
+                time.sleep(waiting)
+                raise Exception('Timeout while waiting for the analog measurement')
+            if remaining>0:
+                time.sleep(remaining)
+            if 'buffer' in task:
+                data = task['buffer'][:points*channels]
+            elif out is not None:
+                data = out[:points*channels]
+            else:
+                data = np.zeros((points*channels,), dtype=np.float64)
+            values = points
+        elif 'buffer' in task:
+            data = task['buffer']
+            values = max(min(available,int(len(data)/channels)),0)
+            data[:values*channels] = self.generate(task,values).ravel()
+            return values,data[:values*channels]
+        else:
+            # The array is sized for the points already acquired by the continuous task. A finite task that was
+            # read completely has no points left
+            values = max(available,0) if task['points']<=0 else 0
+            data = np.zeros((values*channels,), dtype=np.float64)
+        values = max(values,0)
+        data[:values*channels] = self.generate(task,values).ravel()
+        return values,data
+
+    def aiClock(self):
+        """Returns the terminal of the sample clock of the analog inputs, for synchronizing other tasks to it.
+        """
+        return str.encode('/Dev%s/ai/SampleClock'%self.deviceNumber)
+
+    def analogOutputSetup(self,taskNum,channel,points,accuracy,limits=(0.0,10.0),clock=None):
+        """Prepares a buffered analog output task. The waveform has to be written with analogWrite before triggering it.
+        The simulated card only keeps the waveform, it does not affect the inputs.
+        """
+        if type(channel) != type([]):
+            channel = [channel]
+        task = {'name':'TaskAnalogOutput',
+                'TaskHandle':taskNum,
+                'channels':len(channel),
+                'points':int(points),
+                'accuracy':accuracy,
+                'limits':limits,
+                'clock':clock,
+                'waveform':None,
+                'started':None}
+        return self.addTask(task)
+
+    def analogWrite(self,taskNumber,data,waiting=10):
+        """Writes the waveform of an analog output task. It does not start the task.
+        data -- numpy array of shape (channels, points) with the values in volts.
+        Returns the number of points per channel written.
+        """
+        task = self.getTask(taskNumber)
+        data = np.array(data,dtype=np.float64,ndmin=2)
+        if np.any(data<task['limits'][0]) or np.any(data>task['limits'][1]):
+            raise Exception('The waveform is outside the limits of the output')
+        task['waveform'] = data
+        return data.shape[-1]
+
+    def analogReadBinary(self,taskNumber,points,waiting=1):
+        """Reads a number of points from the analog task as the raw integers of the card, without scaling them to volts.
+        Use scalingCoefficients for converting the values to volts.
+        points -- the number of points per channel to be read. If 0 or less, reads the points available.
+        Returns the total number of data points per channel acquired and a numpy array of int16 of length values*channels,
+        grouped by channel.
+        """
+        task = self.getTask(taskNumber)
+        channels = task['channels']
+        if points<=0:
+            points = int((time.time()-task['started'])/task['accuracy'])-task['generated']
+            waiting = .2
+        data = np.zeros((max(int(points),0)*channels,), dtype=np.int16)
+        if points <= 0:
+            return 0,data
+        values,volts = self.analogRead(taskNumber,points,waiting)
+        lsb = self.scalingCoefficients(taskNumber)[:,1]
+        volts = np.reshape(volts[:values*channels],(channels,values))
+        data = data[:values*channels].reshape((channels,values))
+        np.rint(volts/lsb[:,np.newaxis],out=volts)
+        np.clip(volts,-32768,32767,out=data,casting='unsafe')
+        return values,data.ravel()
+
+    def scalingCoefficients(self,taskNumber,ncoeffs=4):
+        """Returns the polynomial that converts the raw values of every channel of the task to volts.
+        The simulated card uses 16 bits over the largest of the limits of every channel.
+        Returns a numpy array of shape (channels, ncoeffs), with the coefficients in increasing order.
+        """
+        task = self.getTask(taskNumber)
+        coeffs = np.zeros((task['channels'],ncoeffs), dtype=np.float64)
+        coeffs[:,1] = np.max(np.abs(task['limits']),axis=1)/32768
+        return coeffs
+
+    def stopTask(self,task):
+        """Stops generating the signals of a task, keeping it configured.
+        """
+        task['started'] = None
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    adq = simDAQ()
+    points = 100000
+    accuracy = 0.00001
+    taskNu = adq.analogSetup(0,[1,2],points,accuracy)
+    adq.analogTrigger(taskNu)
+    v,data = adq.analogRead(taskNu,points,points*accuracy*1.05)
+    data = np.reshape(data[:v*2],(2,v))
+    freqs = np.fft.rfftfreq(v,accuracy)
+    plt.loglog(freqs[1:],np.abs(np.fft.rfft(data[0]))[1:]**2)
+    plt.show()
@@ -12,6 +12,8 @@ class _session():
         self.monitorTimeresol = 5 # In ms -> resolution of the timetrace
         self.monitorRefresh = 500 # In ms -> Refresh time of the monitor interfase
         self.monitorTime = 10 # In seconds -> The length of the timetrace
+        self.monitorBlock = 50 # In ms -> Size of the blocks read in the background from the card
+        self.monitorFps = 30 # Maximum redraws per second of every view of the monitor
         self.dev_conf = '' # Directory with the config file
         self.task_conf = '' # Directory with the task_config file
         self.adq = {} # Device used for data acquisition.
@@ -19,8 +21,33 @@ class _session():
         self.devs = {} # Devices in general
         self.runs = False # Continuous runs of high time accuracy acquisitions
         self.saveDirectory = '' # Directory where to save the data
+        self.highSpeedDevs = ['qpdx','qpdy','qpdz'] # Names of the devices of the power spectra
         self.highSpeedTime = 1 # In seconds
         self.highSpeedAccuracy = .01 # In milliseconds
+        self.highSpeedSimultaneous = True # Acquire all the channels in a single task
+        self.highSpeedRaw = False # Keep the timetraces as int16 and convert them to volts only when needed
+        self.highSpeedSegment = 16384 # Points per segment of the power spectra. 0 uses the whole timetrace
+        self.highSpeedOverlap = 0.5 # Overlap between segments of the power spectra
+        self.highSpeedWindow = 'hann' # Window applied to the segments of the power spectra
+        self.highSpeedPipeline = True # In continuous runs, acquire the next timetrace while processing the previous one
+        self.archiveRuns = False # Archive every run of the power spectra, see Model.archive
+        self.archiveDirectory = '' # Where the runs are archived. Empty for the folder archive in saveDirectory
+        self.archiveMaxBytes = 20e9 # Maximum size of the archive, in bytes. None for no limit
+        self.archiveMaxAge = None # Maximum age of the runs archived, in seconds. None for no limit
+        self.archivePsd = True # Archive also the power spectra of every run
+        self.archiveCompression = 'zlib' # Compression of the runs archived: None, 'zlib' or 'lzma'
+        self.traceCompression = None # Compression of the timetraces saved: None, 'zlib' or 'lzma'. None can be memory mapped
+        self.fftWorkers = -1 # Threads used by the FFT if scipy is installed. -1 uses all the cores
+        self.fftLength = None # None, 'pad' or 'truncate' the segments of the power spectra to a length fast to transform
+        self.psdBinsPerDecade = 100 # Logarithmic bins per decade of the displayed power spectra. 0 displays all the points
+        self.psdEnvelope = False # Display the minimum and maximum of every bin of the power spectra
+        self.psdFitMin = 10 # Lowest frequency used for fitting the power spectra, in Hz. None uses all
+        self.psdFitMax = None # Highest frequency used for fitting the power spectra, in Hz. None uses all
+        self.psdFitAliasing = True # Correct the fit of the power spectra for the aliasing
+        self.qpdFilter = None # 3dB frequency of the QPD, in Hz. None if it is not corrected
+        self.beadRadius = 0.5e-6 # In meters
+        self.viscosity = 8.9e-4 # Of the medium, in Pa s
+        self.temperature = 295 # In kelvin
         ######### PARAMETERS FOR THE CAMERA #########
         self.camera = {}
         self.refreshTime = 60 # Time in ms for refreshing from the camera
@@ -0,0 +1,102 @@
+""" Continuous acquisition running in the background.
+A reader thread takes fixed-size blocks from a continuous task of the card and stores them in a ring buffer.
+Consumers read from the ring buffer at their own pace, without stopping the acquisition.
+"""
+import threading
+import numpy as np
+
+
+class ringBuffer():
+    """Preallocated multi-channel ring buffer with a single writer.
+    The data is stored twice, one copy after the other, so the latest points are always contiguous in memory
+    and can be returned as a view instead of a copy.
+    The number of points written is only updated after the data is in place, therefore readers do not need a lock.
+    A view returned by the buffer is valid until the writer wraps around it, i.e. for capacity-n new points.
+    """
+    def __init__(self,channels,capacity,dtype=np.float64):
+        """channels -- number of channels
+        capacity -- number of points per channel that are kept
+        """
+        self.channels = int(channels)
+        self.capacity = max(int(capacity),1)
+        self.data = np.zeros((self.channels,2*self.capacity),dtype=dtype)
+        self.written = 0 # Total number of points written per channel
+
+    def write(self,block):
+        """Appends a block of data of shape (channels, points) to the buffer.
+        """
+        points = block.shape[1]
+        if points > self.capacity:
+            block = block[:,-self.capacity:]
+        n = block.shape[1]
+        start = (self.written+points-n) % self.capacity
+        first = min(n,self.capacity-start)
+        self.data[:,start:start+first] = block[:,:first]
+        self.data[:,start+self.capacity:start+self.capacity+first] = block[:,:first]
+        if first < n:
+            self.data[:,:n-first] = block[:,first:]
+            self.data[:,self.capacity:self.capacity+n-first] = block[:,first:]
+        self.written += points
+
+    def latest(self,points,written=None):
+        """Returns a view of shape (channels, points) with the latest points written.
+        points -- number of points per channel. It is limited by the capacity and by the points already written.
+        written -- optional, the value of self.written to use as the end of the data.
+        """
+        if written is None:
+            written = self.written
+        points = int(min(points,written,self.capacity))
+        end = written % self.capacity + self.capacity
+        return self.data[:,end-points:end]
+
+    def since(self,count):
+        """Returns the points written after count and the new count.
+        If more than capacity points were written, only the last capacity points are returned.
+        count -- the value of self.written at the previous read.
+        """
+        written = self.written
+        return self.latest(written-count,written),written
+
+    def resized(self,capacity):
+        """Returns a new buffer with a different capacity, holding the latest points of this one.
+        """
+        new = ringBuffer(self.channels,capacity,self.data.dtype)
+        new.write(self.latest(new.capacity))
+        return new
+
+
+class acquisitionThread(threading.Thread):
+    """Thread that reads continuously blocks of points from a task of the card and stores them in a ring buffer.
+    The task has to be continuous and already triggered.
+    """
+    def __init__(self,adq,taskNumber,buffer,points,waiting=1):
+        """adq -- the card, for example niDAQ.
+        taskNumber -- the number of the task in the card.
+        buffer -- the ringBuffer where to store the data.
+        points -- number of points per channel in every block.
+        waiting -- maximum time to wait for a block, in seconds.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.adq = adq
+        self.taskNumber = taskNumber
+        self.buffer = buffer
+        self.points = int(points)
+        self.waiting = waiting
+        self.error = None
+        self.keepRunning = True
+
+    def run(self):
+        try:
+            while self.keepRunning:
+                values,data = self.adq.analogRead(self.taskNumber,self.points,self.waiting)
+                if values > 0:
+                    self.buffer.write(np.reshape(data[:values*self.buffer.channels],(self.buffer.channels,values)))
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        """Stops the thread after the current block.
+        """
+        self.keepRunning = False
+        self.join(self.waiting+1)
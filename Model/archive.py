@@ -0,0 +1,187 @@
+""" Rolling archive of acquisitions.
+Every run is stored as a trace file (see Model.tracefile), optionally with its power spectra, and described by a
+record of fixed size in an index file:
+
+    magic (8 bytes) | number of the first record still archived (uint64) | record 0 | record 1 | ...
+
+The runs are archived in order, therefore the records are sorted by time and the runs between two times are found
+with a binary search over the index, without opening any other file. The index is read only when the archive is
+opened and then kept in memory, the records of new runs are appended to the file and to the memory. Nothing is
+memory mapped, so the index can be rewritten (see compact) while the records are in use, also in Windows.
+When the archive is larger than maxBytes, or its oldest runs older than maxAge, the oldest runs are deleted.
+The trace files can be compressed, see Model.tracefile.
+"""
+import os
+import time
+import struct
+import threading
+import numpy as np
+
+from Model import tracefile
+
+magic = b'UUTARCH1'
+headerSize = 16
+recordDtype = np.dtype([('time','<f8'), # Time of the run, seconds since the epoch
+                        ('id','<u8'), # Number of the run, gives the name of its files
+                        ('points','<u8'),
+                        ('channels','<u4'),
+                        ('psd','<u4'), # 1 if the power spectra are archived
+                        ('accuracy','<f8'), # Time between points in seconds
+                        ('nbytes','<u8')]) # Size of the files of the run
+
+
+class runArchive():
+    """Archive of the runs stored in a directory.
+    """
+    def __init__(self,directory,maxBytes=None,maxAge=None,compression=None):
+        """directory -- where the runs and the index are stored. It is created if needed.
+        maxBytes -- optional, maximum size of the runs archived, in bytes.
+        maxAge -- optional, maximum age of the runs archived, in seconds.
+        compression -- optional, compression of the trace files, 'zlib' or 'lzma'.
+        """
+        self.directory = directory
+        self.compression = compression
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.indexFile = os.path.join(directory,'index.bin')
+        if not os.path.exists(self.indexFile):
+            with open(self.indexFile,'wb') as f:
+                f.write(magic)
+                f.write(struct.pack('<Q',0))
+        size = os.path.getsize(self.indexFile)
+        self.count = (size-headerSize)//recordDtype.itemsize # Records in the index, deleted runs included
+        with open(self.indexFile,'rb') as f:
+            if f.read(8) != magic:
+                raise Exception('%s is not the index of an archive'%self.indexFile)
+            self.first, = struct.unpack('<Q',f.read(8))
+            self._records = np.fromfile(f,dtype=recordDtype,count=self.count)
+        if size != headerSize+self.count*recordDtype.itemsize:
+            # A record was written only in part, it is discarded so that the next ones are aligned
+            with open(self.indexFile,'r+b') as f:
+                f.truncate(headerSize+self.count*recordDtype.itemsize)
+        records = self.records
+        self.totalBytes = int(np.sum(records['nbytes'])) if len(records) else 0
+
+    @property
+    def records(self):
+        """Records of the runs still archived, sorted by time.
+        """
+        return self._records[self.first:self.count]
+
+    def filename(self,id,psd=False):
+        """Name of the trace file of a run, or of its power spectra if psd is True.
+        """
+        name = os.path.join(self.directory,'run_%012d'%id)
+        return name+'_psd.npy' if psd else name+tracefile.extension
+
+    def add(self,data,accuracy,names=None,metadata=None,psd=None,timestamp=None):
+        """Archives a run and deletes the oldest runs if the limits are exceeded.
+        data -- numpy array of shape (channels, points), stored with its dtype.
+        accuracy -- time between points in seconds.
+        names, metadata -- as for tracefile.writeTrace.
+        psd -- optional, tuple with the frequencies and the power spectra of shape (channels, frequencies).
+        timestamp -- time of the run, in seconds since the epoch. If None, now.
+        Returns the record of the run.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            records = self.records
+            if len(records) and timestamp < records['time'][-1]:
+                raise Exception('The runs have to be archived in order of time')
+            id = int(records['id'][-1])+1 if len(records) else self.first
+            metadata = dict(metadata or {})
+            metadata['timestamp'] = timestamp
+            filename = self.filename(id)
+            tracefile.writeTrace(filename,data,accuracy,names,metadata,compression=self.compression)
+            nbytes = os.path.getsize(filename)
+            if psd is not None:
+                np.save(self.filename(id,True),np.vstack((psd[0][np.newaxis,:],psd[1])))
+                nbytes += os.path.getsize(self.filename(id,True))
+            record = np.array([(timestamp,id,data.shape[1],data.shape[0],psd is not None,accuracy,nbytes)],
+                              dtype=recordDtype)
+            with open(self.indexFile,'ab') as f:
+                f.write(record.tobytes())
+            if self.count == len(self._records):
+                # The memory for the records grows by doubling, so appending does not copy them every time
+                grown = np.zeros(max(2*self.count,64),dtype=recordDtype)
+                grown[:self.count] = self._records[:self.count]
+                self._records = grown
+            self._records[self.count] = record[0]
+            self.count += 1
+            self.totalBytes += nbytes
+            self.retain(timestamp)
+            return record[0]
+
+    def retain(self,now):
+        """Deletes the oldest runs until the archive is within its limits. The newest run is always kept.
+        """
+        records = self.records
+        delete = 0
+        total = self.totalBytes
+        while delete < len(records)-1:
+            tooLarge = self.maxBytes is not None and total > self.maxBytes
+            tooOld = self.maxAge is not None and records['time'][delete] < now-self.maxAge
+            if not (tooLarge or tooOld):
+                break
+            total -= int(records['nbytes'][delete])
+            delete += 1
+        if delete == 0:
+            return
+        for record in records[:delete]:
+            for name in (self.filename(record['id']),self.filename(record['id'],True)):
+                if os.path.exists(name):
+                    os.remove(name)
+        self.first += delete
+        self.totalBytes = total
+        with open(self.indexFile,'r+b') as f:
+            f.seek(8)
+            f.write(struct.pack('<Q',self.first))
+        if self.first > 1024 and self.first > self.count-self.first:
+            self.compact()
+
+    def compact(self):
+        """Rewrites the index without the records of the runs deleted.
+        The numbers of the runs, and therefore their files, do not change.
+        """
+        records = self.records.copy()
+        temporary = self.indexFile+'.tmp'
+        with open(temporary,'wb') as f:
+            f.write(magic)
+            f.write(struct.pack('<Q',0))
+            f.write(records.tobytes())
+        os.replace(temporary,self.indexFile)
+        self._records = records
+        self.count = len(records)
+        self.first = 0
+
+    def find(self,start=None,stop=None):
+        """Returns the records of the runs between the times start and stop, included.
+        start, stop -- seconds since the epoch or datetime objects. None means no limit.
+        """
+        if hasattr(start,'timestamp'):
+            start = start.timestamp()
+        if hasattr(stop,'timestamp'):
+            stop = stop.timestamp()
+        with self.lock:
+            records = self.records
+            times = records['time']
+            first = 0 if start is None else np.searchsorted(times,start,side='left')
+            last = len(records) if stop is None else np.searchsorted(times,stop,side='right')
+            return records[first:last].copy()
+
+    def open(self,record):
+        """Returns a tracefile.traceReader with the data of a run.
+        """
+        return tracefile.traceReader(self.filename(record['id']))
+
+    def psd(self,record):
+        """Returns the frequencies and the power spectra of a run, or None if they were not archived.
+        """
+        if not record['psd']:
+            return None
+        data = np.load(self.filename(record['id'],True))
+        return data[0],data[1:]
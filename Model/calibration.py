@@ -0,0 +1,246 @@
+""" Calibration of the trap from the power spectra of the QPD signals.
+The one-sided spectrum of a trapped bead is a Lorentzian, P(f) = D/(pi^2*(fc^2+f^2)), with D the diffusion constant
+in units of the signal (V^2/s) and fc the corner frequency. It is fitted in closed form following
+Berg-Sorensen and Flyvbjerg, Rev. Sci. Instrum. 75, 594 (2004), optionally refined with the aliased Lorentzian of a
+sampled signal and the low-pass filter of the detector.
+All the functions work on several channels at once, i.e. on arrays of shape (channels, frequencies).
+"""
+import os
+import glob
+import numpy as np
+from functools import partial
+from multiprocessing import Pool
+
+from Model import fftbackend
+from Model import tracefile
+from Model.spectra import welch, welchReader, logBin, segmentCount
+
+kB = 1.380649e-23 # Boltzmann constant in J/K
+
+
+def lorentzian(freqs,fc,D):
+    """One-sided Lorentzian power spectrum.
+    fc, D -- numpy arrays with the corner frequency and diffusion constant of every channel.
+    Returns a numpy array of shape (channels, frequencies).
+    """
+    fc = np.asarray(fc,dtype=np.float64)[...,np.newaxis]
+    D = np.asarray(D,dtype=np.float64)[...,np.newaxis]
+    return D/(np.pi**2*(fc**2+freqs**2))
+
+
+def aliasedLorentzian(freqs,fc,D,accuracy,filter=None):
+    """One-sided power spectrum of a trapped bead sampled every accuracy seconds, including the aliasing.
+    filter -- optional, the 3dB frequency of the low-pass filter of the detector (first order).
+    Returns a numpy array of shape (channels, frequencies).
+    """
+    fc = np.asarray(fc,dtype=np.float64)[...,np.newaxis]
+    D = np.asarray(D,dtype=np.float64)[...,np.newaxis]
+    c = np.exp(-2*np.pi*fc*accuracy)
+    dx2 = (1-c**2)*D/(2*np.pi*fc)
+    psd = 2*dx2*accuracy/(1+c**2-2*c*np.cos(2*np.pi*freqs*accuracy))
+    if filter is not None:
+        psd = psd/(1+(freqs/filter)**2)
+    return psd
+
+
+def selectRange(freqs,psd,counts=None,fmin=None,fmax=None):
+    """Keeps the frequencies between fmin and fmax, discarding the frequency 0.
+    counts -- number of points averaged in every bin. If None, 1 is assumed.
+    """
+    freqs = np.asarray(freqs)
+    if counts is None:
+        counts = np.ones(len(freqs))
+    keep = freqs > 0
+    if fmin is not None:
+        keep &= freqs >= fmin
+    if fmax is not None:
+        keep &= freqs <= fmax
+    return freqs[keep],np.atleast_2d(psd)[:,keep],np.asarray(counts,dtype=np.float64)[keep]
+
+
+def lorentzianFit(freqs,psd,counts=None,fmin=None,fmax=None):
+    """Fits a Lorentzian in closed form. The fit is a least-squares fit of 1/P, weighted with the number of points
+    of every bin, and corrected for the bias due to the noise of P.
+    freqs -- frequencies of the spectrum.
+    psd -- numpy array of shape (channels, frequencies) with the one-sided power spectra, blocked or binned.
+    counts -- number of points averaged in every bin, see logBin. If None, 1 is assumed.
+    fmin, fmax -- range of frequencies used in the fit.
+    Returns a dictionary with the numpy arrays 'fc', 'D', 'fcErr' and 'DErr'.
+    """
+    f,p,n = selectRange(freqs,psd,counts,fmin,fmax)
+    f2 = f**2
+    # E[P^2] = (1+1/n)*E[P]^2 for the average of n points, so the squares are corrected for the bias
+    p2 = p**2*n/(n+1)
+    S01 = np.sum(n*p,axis=-1)
+    S11 = np.sum(n*f2*p,axis=-1)
+    S02 = np.sum(n*p2,axis=-1)
+    S12 = np.sum(n*f2*p2,axis=-1)
+    S22 = np.sum(n*f2**2*p2,axis=-1)
+    det = S02*S22-S12**2
+    a = (S01*S22-S11*S12)/det
+    b = (S11*S02-S01*S12)/det
+    fc = np.sqrt(np.abs(a/b))
+    D = np.pi**2/b
+    # The covariance of (a, b) is the inverse of the matrix of the normal equations
+    varA = S22/det
+    varB = S02/det
+    covAB = -S12/det
+    dfcda = 1/(2*fc*b)
+    dfcdb = -a/(2*fc*b**2)
+    fcErr = np.sqrt(dfcda**2*varA+dfcdb**2*varB+2*dfcda*dfcdb*covAB)
+    DErr = np.pi**2/b**2*np.sqrt(varB)
+    return {'fc':fc,'D':D,'fcErr':fcErr,'DErr':DErr}
+
+
+def refineFit(freqs,psd,counts,fc,D,accuracy,filter=None,fmin=None,fmax=None,iterations=20):
+    """Refines a fit with the aliased Lorentzian, and the filter of the detector if given, by Gauss-Newton.
+    The residuals are relative to the model and weighted with the number of points of every bin.
+    fc, D -- initial values, for example from lorentzianFit.
+    Returns a dictionary with the numpy arrays 'fc', 'D', 'fcErr' and 'DErr'.
+    """
+    f,p,n = selectRange(freqs,psd,counts,fmin,fmax)
+    params = np.vstack((np.asarray(fc,dtype=np.float64),np.asarray(D,dtype=np.float64))).T # (channels, 2)
+    w = np.sqrt(n)
+    for i in range(iterations):
+        model = aliasedLorentzian(f,params[:,0],params[:,1],accuracy,filter)
+        residuals = w*(p/model-1)
+        # Numerical derivatives of the model with respect to the relative change of every parameter
+        jac = np.empty(p.shape+(2,))
+        for k in range(2):
+            step = params.copy()
+            step[:,k] *= 1+1e-6
+            dmodel = aliasedLorentzian(f,step[:,0],step[:,1],accuracy,filter)
+            jac[...,k] = -w*p/model**2*(dmodel-model)/(params[:,k:k+1]*1e-6)
+        jtj = np.einsum('cfi,cfj->cij',jac,jac)
+        jtr = np.einsum('cfi,cf->ci',jac,residuals)
+        delta = -np.linalg.solve(jtj,jtr[...,np.newaxis])[...,0]
+        params = params+delta
+        params[:,0] = np.abs(params[:,0])
+        if np.all(np.abs(delta) <= 1e-8*np.abs(params)):
+            break
+    cov = np.linalg.inv(jtj)
+    return {'fc':params[:,0],'D':params[:,1],'fcErr':np.sqrt(cov[:,0,0]),'DErr':np.sqrt(cov[:,1,1])}
+
+
+def calibrate(freqs,psd,counts=None,accuracy=None,aliasing=False,filter=None,fmin=None,fmax=None,
+              radius=0.5e-6,viscosity=8.9e-4,temperature=295.):
+    """Calibrates the trap from the power spectra of every channel.
+    freqs, psd, counts -- the spectra, see lorentzianFit.
+    accuracy -- time between points of the timetraces, in seconds. Needed for the aliasing correction.
+    aliasing -- if True the closed-form fit is refined with the aliased Lorentzian (see refineFit).
+    filter -- optional, the 3dB frequency of the detector. Only used if aliasing is True.
+    fmin, fmax -- range of frequencies used in the fit.
+    radius -- radius of the bead in m.
+    viscosity -- viscosity of the medium in Pa s.
+    temperature -- temperature in K.
+    Returns a dictionary with numpy arrays, one value per channel:
+        'fc' corner frequency (Hz), 'D' diffusion constant (V^2/s), 'kappa' stiffness (N/m),
+        'beta' sensitivity of the detector (V/m), and their errors 'fcErr', 'DErr', 'kappaErr', 'betaErr'.
+    """
+    fit = lorentzianFit(freqs,psd,counts,fmin,fmax)
+    if aliasing:
+        if accuracy is None:
+            raise Exception('The accuracy is needed for correcting the aliasing')
+        fit = refineFit(freqs,psd,counts,fit['fc'],fit['D'],accuracy,filter,fmin,fmax)
+    gamma = 6*np.pi*viscosity*radius # Drag coefficient
+    Dphys = kB*temperature/gamma # Diffusion constant of the bead in m^2/s
+    fit['kappa'] = 2*np.pi*gamma*fit['fc']
+    fit['kappaErr'] = 2*np.pi*gamma*fit['fcErr']
+    fit['beta'] = np.sqrt(np.abs(fit['D'])/Dphys)
+    fit['betaErr'] = fit['beta']*fit['DErr']/(2*np.abs(fit['D']))
+    return fit
+
+
+def loadPowerSpectraData(filename):
+    """Loads the timetraces saved by powerSpectra.fileSave and the time between their points.
+    filename -- the trace file, or for the files saved by older versions either the .dat file with the data or
+        the _config.npy file.
+    Returns a numpy array of shape (channels, points), the accuracy in seconds and the names of the channels.
+    The older files do not store the names, the channels are named by their number.
+    """
+    base,ext = os.path.splitext(filename)
+    if ext == tracefile.extension:
+        with tracefile.traceReader(filename) as reader:
+            return reader.volts(),reader.accuracy,list(reader.names)
+    if base.endswith('_config'):
+        base = base[:-len('_config')]
+    if ext == '.npy':
+        data = np.load(filename,mmap_mode='r')
+    else:
+        data = np.loadtxt(filename,delimiter=',')
+    params = np.loadtxt(base+'_config.dat',delimiter=',')
+    accuracy = params[1]/1000 # Saved in ms
+    data = np.atleast_2d(data)
+    return data,accuracy,['%s'%i for i in range(data.shape[0])]
+
+
+def calibrateFile(filename,nperseg=16384,binsPerDecade=20,fastLength=None,**kwargs):
+    """Calibrates the trap from a file saved by powerSpectra.fileSave.
+    nperseg -- points per segment of the power spectra, see welch.
+    fastLength -- None, 'pad' or 'truncate', see welch.
+    binsPerDecade -- bins of the spectra used in the fit, see logBin.
+    kwargs -- passed to calibrate.
+    Returns the dictionary of calibrate, with the names of the channels in 'names'.
+    """
+    if filename.endswith(tracefile.extension):
+        # Read block by block, the memory needed does not depend on the length of the trace
+        with tracefile.traceReader(filename) as reader:
+            freqs,psd = welchReader(reader,nperseg,fastLength=fastLength)
+            points,accuracy,names = reader.points,reader.accuracy,list(reader.names)
+    else:
+        data,accuracy,names = loadPowerSpectraData(filename)
+        freqs,psd = welch(data,accuracy,nperseg,fastLength=fastLength)
+        points = data.shape[-1]
+    freqs,psd,counts,low,high = logBin(freqs,psd,binsPerDecade)
+    calibration = calibrate(freqs,psd,counts*segmentCount(points,nperseg),accuracy,**kwargs)
+    calibration['names'] = names
+    return calibration
+
+
+def findPowerSpectraFiles(directory):
+    """Finds the timetraces saved by powerSpectra.fileSave in directory and in its subdirectories of one level,
+    i.e. in saveDirectory/<date>/. Every saved run is listed once. For the files saved by older versions,
+    the binary _config.npy file if it exists, because it can be memory mapped, and the .dat file if not.
+    Returns the list of files sorted by name.
+    """
+    traces = glob.glob(os.path.join(directory,'PowerSpectra_Data*'+tracefile.extension))
+    traces += glob.glob(os.path.join(directory,'*','PowerSpectra_Data*'+tracefile.extension))
+    configs = glob.glob(os.path.join(directory,'PowerSpectra_Data*_config.dat'))
+    configs += glob.glob(os.path.join(directory,'*','PowerSpectra_Data*_config.dat'))
+    files = []
+    for config in sorted(configs):
+        base = config[:-len('_config.dat')]
+        if os.path.exists(base+'_config.npy'):
+            files.append(base+'_config.npy')
+        elif os.path.exists(base+'.dat'):
+            files.append(base+'.dat')
+    return sorted(files+traces)
+
+
+def _calibrateOne(filename,kwargs):
+    """Calibrates a single file for calibrateFiles. Errors are returned instead of raised, so that a broken
+    file does not stop the rest of the batch.
+    """
+    try:
+        return filename,calibrateFile(filename,**kwargs),None
+    except Exception as e:
+        return filename,None,'%s'%e
+
+
+def calibrateFiles(filenames,processes=None,**kwargs):
+    """Calibrates many files saved by powerSpectra.fileSave in parallel, one file per process.
+    processes -- number of processes. If None, one per core.
+    kwargs -- passed to calibrateFile.
+    Returns a list with a tuple (filename, calibration, error) per file, in the same order as filenames.
+    calibration is the dictionary of calibrate, or None if the file could not be calibrated; error is the message.
+    """
+    worker = partial(_calibrateOne,kwargs=kwargs)
+    if processes == 1:
+        return [worker(f) for f in filenames]
+    # Every process transforms with a single thread, the cores are already used by the processes
+    pool = Pool(processes,initializer=fftbackend.setBackend,initargs=(fftbackend.backend,1))
+    try:
+        return pool.map(worker,filenames,chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,78 @@
+""" Decimation of long timetraces for displaying them.
+A plot can not show more points than pixels, so the traces are reduced to the minimum and the maximum of every
+group of consecutive points. Unlike taking one point every n, the spikes of the signal are never lost.
+"""
+import numpy as np
+
+from Model.acquisition import ringBuffer
+
+
+def minMax(data,factor):
+    """Reduces every group of factor consecutive points to its minimum and maximum.
+    data -- numpy array of shape (channels, points). The points that do not fill a group are ignored.
+    Returns a numpy array of shape (channels, 2*groups) with the minimum and the maximum of every group, alternated.
+    """
+    groups = data.shape[1]//factor
+    data = np.reshape(data[:,:groups*factor],(data.shape[0],groups,factor))
+    out = np.empty((data.shape[0],groups,2),dtype=data.dtype)
+    np.min(data,axis=2,out=out[:,:,0])
+    np.max(data,axis=2,out=out[:,:,1])
+    return np.reshape(out,(data.shape[0],2*groups))
+
+
+class envelopeBuffer():
+    """Ring buffer with the min/max decimation of a timetrace, updated as new blocks of points arrive.
+    The first row of the blocks is the time, that is not decimated: every group keeps the time of its first point,
+    twice. The rest of the rows are reduced with minMax. The points that do not fill a group wait for the next block.
+    The buffer keeps twice the points displayed, so a view returned by latest stays valid while as many points
+    as displayed are written.
+    """
+    def __init__(self,channels,points,pixels):
+        """channels -- number of rows of the blocks, including the time.
+        points -- number of points of the timetrace displayed.
+        pixels -- width of the plot. The trace is reduced to about twice the pixels.
+        """
+        self.channels = int(channels)
+        self.points = int(points)
+        self.pixels = max(int(pixels),1)
+        self.factor = max(int(np.ceil(self.points/self.pixels)),1)
+        self.width = 1 if self.factor == 1 else 2 # Columns per group
+        self.displayed = self.width*int(np.ceil(self.points/self.factor))
+        self.buffer = ringBuffer(self.channels,2*self.displayed)
+        self.pending = np.empty((self.channels,self.factor))
+        self.pendingCount = 0
+
+    def reduce(self,block):
+        """Decimates a block of complete groups and stores it.
+        """
+        if self.factor == 1:
+            self.buffer.write(block)
+            return
+        reduced = np.empty((self.channels,2*(block.shape[1]//self.factor)))
+        reduced[0] = np.repeat(block[0,::self.factor],2)
+        reduced[1:] = minMax(block[1:],self.factor)
+        self.buffer.write(reduced)
+
+    def write(self,block):
+        """Appends a block of shape (channels, points).
+        """
+        start = 0
+        if self.pendingCount > 0:
+            start = min(self.factor-self.pendingCount,block.shape[1])
+            self.pending[:,self.pendingCount:self.pendingCount+start] = block[:,:start]
+            self.pendingCount += start
+            if self.pendingCount < self.factor:
+                return
+            self.reduce(self.pending)
+            self.pendingCount = 0
+        full = start+(block.shape[1]-start)//self.factor*self.factor
+        if full > start:
+            self.reduce(block[:,start:full])
+        rest = block.shape[1]-full
+        self.pending[:,:rest] = block[:,full:]
+        self.pendingCount = rest
+
+    def latest(self):
+        """Returns a view of shape (channels, about 2*pixels) with the decimated trace displayed.
+        """
+        return self.buffer.latest(self.displayed)
@@ -0,0 +1,112 @@
+""" Fast Fourier transforms used by the spectral analysis.
+scipy.fft is used when it is installed, because it can split the transforms of many segments between several
+threads (workers); otherwise numpy.fft is used. Both keep the plans of the lengths already transformed, therefore
+transforming repeatedly segments of the same length only pays the planning once. The scratch buffers where the
+segments are windowed are also kept and reused, one set per thread.
+The speed of the FFT depends a lot on the length: lengths with only small prime factors (2, 3, 5) are the fastest.
+fastLength gives the closest fast length, for zero-padding or truncating the data.
+"""
+import threading
+import numpy as np
+
+try:
+    import scipy.fft as _scipyfft
+except ImportError:
+    _scipyfft = None
+
+backends = ('scipy','numpy')
+backend = 'scipy' if _scipyfft is not None else 'numpy'
+workers = -1 # Threads used by scipy.fft. -1 uses all the cores
+_local = threading.local()
+
+
+def setBackend(name,threads=None):
+    """Selects the library used for the transforms.
+    name -- 'scipy' or 'numpy'.
+    threads -- optional, number of threads used by scipy.fft (-1 for all the cores).
+    """
+    global backend, workers
+    if name not in backends:
+        raise Exception('FFT backend %s not known, use one of %s'%(name,', '.join(backends)))
+    if name == 'scipy' and _scipyfft is None:
+        raise Exception('scipy.fft is not available')
+    backend = name
+    if threads is not None:
+        workers = int(threads)
+
+
+def rfft(data,n=None,axis=-1,overwrite=False):
+    """Transform of real data along axis, as numpy.fft.rfft.
+    n -- length of the transform. The data is zero-padded or truncated to it.
+    overwrite -- if True, the data can be destroyed. It avoids a copy with scipy.fft.
+    """
+    if backend == 'scipy':
+        return _scipyfft.rfft(data,n=n,axis=axis,overwrite_x=overwrite,workers=workers)
+    return np.fft.rfft(data,n=n,axis=axis)
+
+
+def rfftfreq(n,d=1.0):
+    """Frequencies of the output of rfft, as numpy.fft.rfftfreq.
+    """
+    return np.fft.rfftfreq(n,d)
+
+
+def _isFast(n):
+    for p in (2,3,5):
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+
+def nextFastLength(n):
+    """Smallest length equal or larger than n with only the prime factors 2, 3 and 5.
+    """
+    n = int(n)
+    if n <= 1:
+        return 1
+    if _scipyfft is not None:
+        return _scipyfft.next_fast_len(n,real=True)
+    while not _isFast(n):
+        n += 1
+    return n
+
+
+def previousFastLength(n):
+    """Largest length equal or smaller than n with only the prime factors 2, 3 and 5.
+    """
+    n = int(n)
+    if n <= 1:
+        return max(n,0)
+    if _scipyfft is not None and hasattr(_scipyfft,'prev_fast_len'):
+        return _scipyfft.prev_fast_len(n,real=True)
+    while not _isFast(n):
+        n -= 1
+    return n
+
+
+def fastLength(n,mode=None):
+    """Length to use for transforming n points.
+    mode -- None keeps n, 'pad' rounds up to a fast length (zero-padding) and 'truncate' rounds down.
+    """
+    if mode is None:
+        return int(n)
+    if mode == 'pad':
+        return nextFastLength(n)
+    if mode == 'truncate':
+        return previousFastLength(n)
+    raise Exception('Mode %s not known, use None, pad or truncate'%mode)
+
+
+def scratch(shape,name='default'):
+    """Returns a float64 buffer of the given shape, reused between calls from the same thread.
+    The content is not initialized.
+    name -- different names give different buffers.
+    """
+    buffers = getattr(_local,'buffers',None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    size = int(np.prod(shape))
+    buf = buffers.get(name)
+    if buf is None or buf.size < size:
+        buf = buffers[name] = np.empty(size)
+    return buf[:size].reshape(shape)
@@ -0,0 +1,91 @@
+""" Timetraces kept as the raw integers given by the card.
+The conversion to volts is done only when it is needed, and only for the part of the data that is needed.
+"""
+import numpy as np
+
+
+def scale(raw,coefficients,out=None):
+    """Converts raw values to volts using the polynomial of the card.
+    raw -- numpy array of integers.
+    coefficients -- coefficients of the polynomial, in increasing order, as given by DAQmxGetAIDevScalingCoeff.
+    out -- optional numpy array of floats where to store the result.
+    """
+    if out is None:
+        out = np.empty(raw.shape,dtype=np.float64)
+    out[...] = coefficients[-1]
+    for c in coefficients[-2::-1]:
+        out *= raw
+        out += c
+    return out
+
+
+class rawTrace():
+    """Multi-channel timetrace stored as int16.
+    Indexing with the number of a channel returns the volts of that channel, so it can be used
+    in the places where a list of arrays (one per channel) is expected.
+    """
+    def __init__(self,raw,coefficients,accuracy=None):
+        """raw -- numpy array of shape (channels, points) with the raw values.
+        coefficients -- numpy array of shape (channels, number of coefficients) with the scaling of every channel.
+        accuracy -- optional, time between points in seconds.
+        """
+        self.raw = raw
+        self.coefficients = np.array(coefficients,dtype=np.float64)
+        self.accuracy = accuracy
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def __getitem__(self,channel):
+        return self.volts(channel)
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def channels(self):
+        return self.raw.shape[0]
+
+    @property
+    def points(self):
+        return self.raw.shape[1]
+
+    def volts(self,channel=None,start=0,stop=None):
+        """Returns the data converted to volts.
+        channel -- the channel to convert. If None, all the channels are converted.
+        start, stop -- the range of points to convert.
+        """
+        if channel is None:
+            out = np.empty((self.raw.shape[0],len(range(*slice(start,stop).indices(self.raw.shape[1])))))
+            for i in range(self.raw.shape[0]):
+                scale(self.raw[i,start:stop],self.coefficients[i],out[i])
+            return out
+        return scale(self.raw[channel,start:stop],self.coefficients[channel])
+
+    def chunks(self,points):
+        """Iterates over the data converted to volts, in blocks of points per channel.
+        Only one block is converted at a time.
+        """
+        for start in range(0,self.raw.shape[1],int(points)):
+            yield self.volts(None,start,start+int(points))
+
+    def blocks(self,points,overlap=0,channels=None,volts=False):
+        """Iterates over the data in blocks of the given number of points that share overlap points, as
+        tracefile.traceReader.blocks, so a rawTrace can be transformed with spectra.welchReader.
+        channels -- optional, list with the channels.
+        volts -- if True the blocks are converted to volts, one at a time; if False the raw values are given.
+        """
+        points = int(points)
+        advance = max(points-int(overlap),1)
+        if channels is None:
+            channels = list(range(self.raw.shape[0]))
+        for start in range(0,max(self.raw.shape[1]-int(overlap),1),advance):
+            if not volts:
+                yield self.raw[channels,start:start+points]
+                continue
+            raw = self.raw[:,start:start+points]
+            out = np.empty((len(channels),raw.shape[1]))
+            for i,c in enumerate(channels):
+                scale(raw[c],self.coefficients[c],out[i])
+            yield out
@@ -0,0 +1,133 @@
+""" Recording of long timetraces directly to disk.
+The card is read in chunks that are appended to a trace file (see Model.tracefile) as they arrive, therefore the
+length of the recording is limited by the disk and not by the memory. The recordings are read, and analysed block
+by block, with tracefile.traceReader.
+"""
+import threading
+import numpy as np
+
+from Model import tracefile
+
+
+class runningStats():
+    """Mean, variance, minimum and maximum of every channel, updated block by block.
+    The blocks are merged with the parallel version of Welford's algorithm, so the raw data does not need to be kept.
+    """
+    def __init__(self,channels):
+        self.channels = int(channels)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets all the data.
+        """
+        with self.lock:
+            self.count = 0
+            self.mean = np.zeros(self.channels)
+            self.m2 = np.zeros(self.channels) # Sum of the squared differences to the mean
+            self.min = np.full(self.channels,np.inf)
+            self.max = np.full(self.channels,-np.inf)
+
+    def update(self,block):
+        """Adds a block of data of shape (channels, points).
+        """
+        n = block.shape[1]
+        if n == 0:
+            return
+        mean = np.mean(block,axis=1)
+        m2 = np.var(block,axis=1)*n
+        with self.lock:
+            total = self.count+n
+            delta = mean-self.mean
+            self.mean = self.mean+delta*n/total
+            self.m2 = self.m2+m2+delta**2*self.count*n/total
+            self.count = total
+            self.min = np.minimum(self.min,np.min(block,axis=1))
+            self.max = np.maximum(self.max,np.max(block,axis=1))
+
+    @property
+    def var(self):
+        with self.lock:
+            if self.count == 0:
+                return np.full(self.channels,np.nan)
+            return self.m2/self.count
+
+    def get(self):
+        """Returns a dictionary with the count and the mean, variance, minimum and maximum of every channel.
+        """
+        var = self.var
+        with self.lock:
+            return {'count':self.count,'mean':self.mean.copy(),'var':var,'min':self.min.copy(),'max':self.max.copy()}
+
+
+class recordingThread(threading.Thread):
+    """Thread that reads chunks from a continuous task of the card and appends them to a trace file.
+    Every chunk read is a chunk of the file, and it is passed to the system at once, so the data recorded is readable
+    even if the program stops before the end of the recording. It is synced to the disk every syncEvery chunks, so
+    that little is lost if the computer stops.
+    """
+    def __init__(self,adq,taskNumber,channels,points,chunk,filename,raw=False,waiting=1,accuracy=None,names=None,
+                 metadata=None,append=False,syncEvery=20):
+        """adq -- the card, for example niDAQ.
+        taskNumber -- the number of the task in the card. It has to be continuous and already triggered. It is cleared
+            when the recording finishes.
+        channels -- number of channels of the task.
+        points -- total number of points per channel to record.
+        chunk -- number of points per channel read each time.
+        filename -- the file where to store the data.
+        raw -- if True, the data is stored as the int16 values of the card.
+        waiting -- maximum time to wait for a chunk, in seconds.
+        accuracy, names, metadata -- description of the data stored in the header of the file, see tracefile.traceWriter.
+        append -- if True and the file exists, the data is appended to it.
+        syncEvery -- number of chunks between syncs of the file to the disk. It is always synced when it is closed.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.adq = adq
+        self.taskNumber = taskNumber
+        self.channels = int(channels)
+        self.points = int(points)
+        self.chunk = int(chunk)
+        self.filename = filename
+        self.raw = raw
+        self.waiting = waiting
+        self.syncEvery = max(int(syncEvery),1)
+        self.stats = runningStats(self.channels)
+        self.recorded = 0 # Points per channel recorded
+        self.error = None
+        self.keepRunning = True
+        self.writer = tracefile.traceWriter(filename,self.channels,accuracy,np.int16 if raw else np.float64,names,
+                                            metadata,chunk,append)
+
+    def run(self):
+        try:
+            chunks = 0 # Chunks written since the last sync
+            with self.writer:
+                while self.keepRunning and self.recorded < self.points:
+                    toRead = min(self.chunk,self.points-self.recorded)
+                    if self.raw:
+                        values,data = self.adq.analogReadBinary(self.taskNumber,toRead,self.waiting)
+                    else:
+                        values,data = self.adq.analogRead(self.taskNumber,toRead,self.waiting)
+                    data = np.reshape(data[:values*self.channels],(self.channels,values))
+                    self.writer.write(data)
+                    if values > 0:
+                        chunks += 1
+                    if chunks >= self.syncEvery:
+                        self.writer.flush(sync=True)
+                        chunks = 0
+                    else:
+                        self.writer.flush(sync=False)
+                    self.recorded += values
+                    self.stats.update(data)
+        except Exception as e:
+            self.error = e
+        finally:
+            # The task is stopped as soon as the recording finishes, not when it is collected
+            self.adq.clear(self.taskNumber)
+
+    def stop(self):
+        """Stops the recording after the current chunk. The task of the card is stopped by the thread.
+        """
+        self.keepRunning = False
+        self.join()
@@ -0,0 +1,75 @@
+""" Saving of data in the background.
+Writing to disk, specially to a network drive, can take seconds. The data to save is handed to a thread that
+writes it while the acquisition and the GUI go on. The queue of data waiting to be written is bounded, so a
+slow disk can not fill the memory.
+"""
+import queue
+import threading
+
+
+class saveWriter(threading.Thread):
+    """Thread that runs the saving jobs one after the other.
+    A job is a function with its arguments, for example tracefile.writeTrace and the data to write. The data
+    handed to a job must not change afterwards, i.e. it has to be a copy if the original is going to be reused.
+    """
+    def __init__(self,maxQueue=8,callback=None):
+        """maxQueue -- maximum number of jobs waiting.
+        callback -- optional, function called after every job with its filename and None, or the error if the job
+            failed. It is called from the thread of the writer.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue.Queue(maxQueue)
+        self.callback = callback
+        self.pending = set() # Files waiting to be written
+        self.lock = threading.Lock()
+        self.start()
+
+    def save(self,filename,function,*args,**kwargs):
+        """Queues a job. The job is function(filename,*args,**kwargs).
+        Raises an exception if the queue is full.
+        """
+        with self.lock:
+            self.pending.add(filename)
+        try:
+            self.queue.put((filename,function,args,kwargs),block=False)
+        except queue.Full:
+            with self.lock:
+                self.pending.discard(filename)
+            raise Exception('Too many files waiting to be saved, %s is not saved'%filename)
+
+    def isPending(self,filename):
+        """True if the file is waiting to be written. Used for not giving the same name to two files.
+        """
+        with self.lock:
+            return filename in self.pending
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+            filename,function,args,kwargs = job
+            error = None
+            try:
+                function(filename,*args,**kwargs)
+            except Exception as e:
+                error = e
+            with self.lock:
+                self.pending.discard(filename)
+            self.queue.task_done()
+            if self.callback is not None:
+                self.callback(filename,error)
+
+    def flush(self):
+        """Waits until all the jobs queued are written.
+        """
+        self.queue.join()
+
+    def stop(self):
+        """Writes all the jobs queued and stops the thread.
+        """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
@@ -0,0 +1,30 @@
+""" Waveforms and binning for hardware-timed raster scans of the piezo stage.
+The scan is bidirectional: every line is scanned forward and then backward before moving to the next line.
+"""
+import numpy as np
+
+
+def rasterWaveform(center,size,pixels,samplesPerPixel):
+    """Generates the voltages of the two axes of the piezo for a bidirectional raster scan.
+    center -- tuple with the voltages (fast axis, slow axis) of the center of the scan.
+    size -- total range of the scan in volts. The same for both axes.
+    pixels -- number of pixels per line and number of lines.
+    samplesPerPixel -- number of samples spent in every pixel.
+    Returns a numpy array of shape (2, pixels*2*pixels*samplesPerPixel); the first row is the fast axis.
+    """
+    positions = np.linspace(-size/2,size/2,pixels)
+    line = np.repeat(np.concatenate((positions,positions[::-1])),samplesPerPixel)
+    fast = np.tile(line,pixels)+center[0]
+    slow = np.repeat(positions,2*pixels*samplesPerPixel)+center[1]
+    return np.vstack((fast,slow))
+
+
+def binPixels(data,pixels,samplesPerPixel):
+    """Averages the samples acquired during a bidirectional raster scan into pixels.
+    data -- numpy array of shape (channels, points) acquired with the waveform of rasterWaveform.
+    Returns two numpy arrays of shape (channels, pixels, pixels) with the forward and backward images.
+    The backward image is flipped so that both images have the same orientation.
+    """
+    data = np.reshape(data,(data.shape[0],pixels,2,pixels,samplesPerPixel))
+    images = data.mean(axis=-1)
+    return images[:,:,0,:],images[:,:,1,::-1]
@@ -0,0 +1,230 @@
+""" Power spectral densities of timetraces.
+The spectra are estimated with Welch's method: the traces are split in overlapping segments, every segment is
+windowed and transformed, and the periodograms of the segments are averaged. All the channels and segments are
+transformed in a single call to the FFT, see Model.fftbackend.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from Model import fftbackend
+
+windows = {'hann':np.hanning,
+           'hamming':np.hamming,
+           'blackman':np.blackman,
+           'boxcar':np.ones}
+
+
+def getWindow(name,points):
+    """Returns the window with the given name ('hann', 'hamming', 'blackman' or 'boxcar') and length.
+    The windows are periodic, as is usual for spectral analysis.
+    """
+    if name not in windows:
+        raise Exception('Window %s not known, use one of %s'%(name,', '.join(windows)))
+    return windows[name](points+1)[:-1]
+
+
+_windowCache = {}
+
+def windowTransform(name,points,nfft):
+    """Returns the window, the rfft of the window with nfft points and the sum of the squares of the window.
+    They are computed once for every combination of parameters.
+    """
+    key = (name,points,nfft)
+    if key not in _windowCache:
+        w = getWindow(name,points)
+        _windowCache[key] = (w,fftbackend.rfft(w,nfft),np.sum(w**2))
+    return _windowCache[key]
+
+
+def segments(data,nperseg,step):
+    """Returns a view of shape (channels, segments, nperseg) of data, without copying it.
+    data -- numpy array of shape (channels, points)
+    nperseg -- number of points of every segment
+    step -- number of points between the start of consecutive segments
+    """
+    data = np.ascontiguousarray(data)
+    nseg = 1+(data.shape[-1]-nperseg)//step
+    shape = data.shape[:-1]+(nseg,nperseg)
+    strides = data.strides[:-1]+(step*data.strides[-1],data.strides[-1])
+    return as_strided(data,shape=shape,strides=strides)
+
+
+def segmentCount(points,nperseg=None,overlap=0.5):
+    """Number of segments averaged by welch for a trace of the given number of points.
+    """
+    if nperseg is None or nperseg <= 0 or nperseg > points:
+        nperseg = points
+    step = max(int(int(nperseg)*(1-overlap)),1)
+    return 1+(points-int(nperseg))//step
+
+
+def segmentLengths(points,nperseg=None,fastLength=None):
+    """Returns the number of points per segment and the length of their transform, see welch.
+    """
+    if nperseg is None or nperseg <= 0 or nperseg > points:
+        nperseg = points
+    nperseg = int(nperseg)
+    nfft = nperseg
+    if fastLength == 'truncate':
+        nperseg = nfft = fftbackend.fastLength(nperseg,'truncate')
+    elif fastLength is not None:
+        nfft = fftbackend.fastLength(nperseg,fastLength)
+    return nperseg,nfft
+
+
+def addPeriodograms(psd,data,nperseg,step,nfft,window='hann',detrend=True,maxPoints=2**22):
+    """Adds to psd the squared transforms of all the windowed segments of data.
+    Returns the number of segments added.
+    """
+    segs = segments(data,nperseg,step)
+    nseg = segs.shape[-2]
+    w,wfft,wsum = windowTransform(window,nperseg,nfft)
+    batch = max(int(maxPoints/(nperseg*data.shape[0])),1)
+    for start in range(0,nseg,batch):
+        block = segs[:,start:start+batch,:]
+        windowed = fftbackend.scratch(block.shape,'welch')
+        np.multiply(block,w,out=windowed)
+        spec = fftbackend.rfft(windowed,nfft,axis=-1,overwrite=True)
+        if detrend:
+            # Removing the mean before windowing is the same as subtracting the transform of the scaled window
+            spec -= np.mean(block,axis=-1)[...,np.newaxis]*wfft
+        psd += np.sum(spec.real**2+spec.imag**2,axis=-2)
+    return nseg
+
+
+def normalize(psd,nseg,accuracy,nperseg,nfft,window='hann'):
+    """Converts the sum of the periodograms of nseg segments to a one-sided power spectral density, in place.
+    """
+    w,wfft,wsum = windowTransform(window,nperseg,nfft)
+    psd /= nseg*wsum/accuracy
+    # One-sided: the power of the negative frequencies is added, except for DC and Nyquist
+    if nfft % 2:
+        psd[...,1:] *= 2
+    else:
+        psd[...,1:-1] *= 2
+    return psd
+
+
+def welch(data,accuracy,nperseg=None,overlap=0.5,window='hann',detrend=True,maxPoints=2**22,fastLength=None):
+    """Estimates the one-sided power spectral density of every channel, in units of data squared per Hz.
+    data -- numpy array of shape (channels, points), or of shape (points,) for a single channel.
+    accuracy -- time between points in seconds.
+    nperseg -- number of points per segment. If None or larger than the trace, the whole trace is used as one segment.
+    overlap -- fraction of overlap between consecutive segments.
+    window -- name of the window, see getWindow.
+    detrend -- if True the mean of every segment is removed.
+    maxPoints -- maximum number of points transformed at once, for limiting the memory used.
+    fastLength -- None transforms the segments as they are. 'pad' zero-pads every segment to a length that is fast
+        to transform, which gives a finer grid of frequencies, and 'truncate' shortens the segments to a fast length.
+    Returns the frequencies and a numpy array of shape (channels, frequencies).
+    """
+    data = np.atleast_2d(np.asarray(data,dtype=np.float64))
+    nperseg,nfft = segmentLengths(data.shape[-1],nperseg,fastLength)
+    step = max(int(nperseg*(1-overlap)),1)
+    psd = np.zeros(data.shape[:-1]+(nfft//2+1,))
+    nseg = addPeriodograms(psd,data,nperseg,step,nfft,window,detrend,maxPoints)
+    normalize(psd,nseg,accuracy,nperseg,nfft,window)
+    return fftbackend.rfftfreq(nfft,accuracy),psd
+
+
+def welchReader(reader,nperseg=None,overlap=0.5,window='hann',detrend=True,maxPoints=2**22,fastLength=None,
+                mean=False):
+    """As welch, but for a trace that does not fit in memory. The trace is read in blocks of about maxPoints
+    points that overlap as the segments do, so the result is the same as welch of the whole trace.
+    reader -- an object like Model.tracefile.traceReader or Model.rawtrace.rawTrace, with the attributes channels,
+        points and accuracy, and the method blocks(points,overlap,volts=True) that gives the data in volts.
+    mean -- if True the mean of every channel, computed from the same blocks, is also returned.
+    """
+    nperseg,nfft = segmentLengths(reader.points,nperseg,fastLength)
+    step = max(int(nperseg*(1-overlap)),1)
+    segs = max(int(maxPoints/(nperseg*reader.channels)),1) # Segments per block
+    psd = np.zeros((reader.channels,nfft//2+1))
+    sums = np.zeros(reader.channels)
+    nseg = 0
+    summed = 0 # Points already added to sums, the overlap of the blocks is not added twice
+    blockPoints = nperseg+(segs-1)*step
+    for i,block in enumerate(reader.blocks(blockPoints,nperseg-step,volts=True)):
+        block = np.asarray(block,dtype=np.float64)
+        if mean:
+            start = i*(blockPoints-(nperseg-step))
+            sums += np.sum(block[:,summed-start:],axis=1)
+            summed = start+block.shape[-1]
+        if block.shape[-1] >= nperseg:
+            nseg += addPeriodograms(psd,block,nperseg,step,nfft,window,detrend,maxPoints)
+    normalize(psd,nseg,reader.accuracy,nperseg,nfft,window)
+    if mean:
+        return fftbackend.rfftfreq(nfft,reader.accuracy),psd,sums/max(summed,1)
+    return fftbackend.rfftfreq(nfft,reader.accuracy),psd
+
+
+def logBin(freqs,psd,binsPerDecade=50,envelope=False):
+    """Reduces a spectrum to bins equally spaced in a logarithmic scale. The frequency 0 is discarded.
+    freqs -- the frequencies of the spectrum, in increasing order.
+    psd -- numpy array of shape (channels, frequencies), or (frequencies,).
+    binsPerDecade -- number of bins in every decade of frequency.
+    envelope -- if True, the minimum and maximum of every bin are also computed.
+    Returns the mean frequency of every bin, the mean of the psd in every bin, the number of points in every bin,
+    and the minimum and maximum of every bin (None if envelope is False). Empty bins are not returned.
+    """
+    freqs = np.asarray(freqs)
+    psd = np.asarray(psd)
+    positive = freqs > 0
+    freqs = freqs[positive]
+    psd = psd[...,positive]
+    index = np.floor(np.log10(freqs)*binsPerDecade).astype(np.int64)
+    starts = np.concatenate(([0],np.flatnonzero(np.diff(index))+1))
+    counts = np.diff(np.concatenate((starts,[len(freqs)])))
+    binFreqs = np.add.reduceat(freqs,starts)/counts
+    mean = np.add.reduceat(psd,starts,axis=-1)/counts
+    low = high = None
+    if envelope:
+        low = np.minimum.reduceat(psd,starts,axis=-1)
+        high = np.maximum.reduceat(psd,starts,axis=-1)
+    return binFreqs,mean,counts,low,high
+
+
+class psdAverager():
+    """Running average of power spectra, for example of consecutive runs.
+    Only the mean and, optionally, the variance of every bin are kept (Welford's algorithm), never the spectra or the traces.
+    If the frequencies change, for example because the acquisition parameters changed, the average starts again.
+    """
+    def __init__(self,variance=True):
+        """variance -- if True the variance of every bin is also computed.
+        """
+        self.variance = variance
+        self.reset()
+
+    def reset(self):
+        """Forgets all the spectra averaged.
+        """
+        self.count = 0
+        self.freqs = None
+        self.mean = None
+        self.m2 = None # Sum of the squared differences to the mean
+
+    def update(self,freqs,psd):
+        """Adds a spectrum to the average.
+        freqs -- the frequencies of the spectrum.
+        psd -- numpy array of shape (channels, frequencies).
+        Returns the number of spectra averaged.
+        """
+        if self.freqs is None or len(freqs) != len(self.freqs) or not np.allclose(freqs,self.freqs):
+            self.reset()
+            self.freqs = np.array(freqs)
+            self.mean = np.zeros(np.shape(psd))
+            if self.variance:
+                self.m2 = np.zeros(np.shape(psd))
+        self.count += 1
+        delta = psd-self.mean
+        self.mean += delta/self.count
+        if self.variance:
+            self.m2 += delta*(psd-self.mean)
+        return self.count
+
+    @property
+    def var(self):
+        """Variance of every bin between the averaged spectra, None if it is not available.
+        """
+        if not self.variance or self.count < 2:
+            return None
+        return self.m2/(self.count-1)
@@ -0,0 +1,433 @@
+""" Binary files for multi-channel timetraces.
+A trace file holds the data together with its description, so no other file is needed for using it:
+
+    magic (8 bytes) | length of the header (uint64) | header (json)
+    chunk 0 | chunk 1 | ...
+    index | offset of the index (uint64) | number of chunks (uint64) | magic of the index (8 bytes)
+
+The header describes the data (number of channels, dtype, time between points, names of the channels) and holds
+any other metadata, for example the calibration of the devices and the parameters of the session.
+Every chunk holds consecutive points of all the channels, interleaved, i.e. it is an array of shape
+(points, channels). The index gives the first point, the number of points, and the position of every chunk,
+therefore any range of points can be read without reading the rest of the file.
+Data can be appended to an existing file: the new chunks overwrite the index, that is written again at the end.
+If a file was not closed, for example because the program crashed, the chunks written are still readable.
+
+The chunks can be compressed without loss with zlib or lzma (header 'compression'). Before compressing, the points
+can be replaced by their differences with the previous point ('delta', the signals are smooth so the differences are
+small) and the bytes of the values can be grouped by significance ('shuffle', the high bytes of the values barely
+change). Every chunk is compressed on its own, so any range of points is still read without decompressing the rest
+of the file, and several chunks can be decompressed at the same time in different threads. A compressed chunk is
+preceded by its number of points and its size in bytes (uint64 each), so the chunks of a file that was not closed
+are still found. Compressed files can not be memory mapped.
+"""
+import os
+import json
+import struct
+import zlib
+import lzma
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+
+from Model.rawtrace import scale
+
+extension = '.trace'
+magic = b'UUTRACE1'
+indexMagic = b'UUTRIDX1'
+indexDtype = np.dtype([('start','<u8'),('points','<u8'),('offset','<u8'),('nbytes','<u8')])
+footer = struct.Struct('<QQ8s')
+chunkHeader = struct.Struct('<QQ') # Points and bytes of a compressed chunk
+compressions = {'zlib':(zlib.compress,zlib.decompress),
+                'lzma':(lambda data,level: lzma.compress(data,preset=level),lzma.decompress)}
+defaultLevels = {'zlib':6,'lzma':1}
+
+
+def sessionParameters(_session):
+    """Returns a dictionary with the parameters of the session that can be stored in the header of a file.
+    """
+    params = {}
+    for key,value in vars(_session).items():
+        if isinstance(value,(bool,int,float,str,type(None))):
+            params[key] = value
+        elif isinstance(value,(list,tuple)) and all(isinstance(v,(bool,int,float,str)) for v in value):
+            params[key] = list(value)
+    return params
+
+
+def deviceParameters(devs):
+    """Returns a list with the properties of every device, i.e. their ports, limits and calibration.
+    """
+    return [dict(dev.properties) for dev in devs]
+
+
+def defaultFilters(dtype):
+    """Filters applied by default before compressing. The raw values of the card compress best with the delta and
+    the shuffle; for floats the delta of their bits does not help and the shuffle alone is smaller and faster
+    (see Scripts/benchmarkCompression.py).
+    """
+    if np.dtype(dtype).kind in 'iu':
+        return ['delta','shuffle']
+    return ['shuffle']
+
+
+def encode(block,filters,compression,level):
+    """Returns the bytes stored for a chunk of shape (points, channels).
+    """
+    if 'delta' in filters:
+        # The differences are taken between the bits of the values, as unsigned integers, so they are exact
+        bits = block.view('<u%s'%block.dtype.itemsize)
+        delta = np.empty_like(bits)
+        delta[:1] = bits[:1]
+        np.subtract(bits[1:],bits[:-1],out=delta[1:])
+        block = delta
+    raw = block.tobytes()
+    if 'shuffle' in filters:
+        raw = np.frombuffer(raw,dtype=np.uint8).reshape(-1,block.dtype.itemsize).T.tobytes()
+    return compressions[compression][0](raw,level)
+
+
+def decode(raw,points,channels,dtype,filters,compression):
+    """Returns the chunk of shape (points, channels) stored as raw by encode.
+    """
+    raw = compressions[compression][1](raw)
+    if 'shuffle' in filters:
+        raw = np.frombuffer(raw,dtype=np.uint8).reshape(dtype.itemsize,-1).T.tobytes()
+    data = np.frombuffer(raw,dtype=dtype).reshape(points,channels)
+    if 'delta' in filters:
+        data = np.cumsum(data.view('<u%s'%dtype.itemsize),axis=0,dtype='<u%s'%dtype.itemsize).view(dtype)
+    return data
+
+
+def _findChunks(f,start,end):
+    """Index of the compressed chunks between the positions start and end of a file that was not closed.
+    """
+    index = []
+    points = 0
+    position = start
+    while position+chunkHeader.size <= end:
+        f.seek(position)
+        count,nbytes = chunkHeader.unpack(f.read(chunkHeader.size))
+        if position+chunkHeader.size+nbytes > end:
+            break
+        index.append((points,count,position+chunkHeader.size,nbytes))
+        points += count
+        position += chunkHeader.size+nbytes
+    return np.array(index,dtype=indexDtype),position
+
+
+def _readStructure(f):
+    """Reads the header and the index of an open trace file.
+    Returns the header, the index and the position where the index starts.
+    """
+    f.seek(0)
+    if f.read(8) != magic:
+        raise Exception('%s is not a trace file'%f.name)
+    length, = struct.unpack('<Q',f.read(8))
+    header = json.loads(f.read(length).decode('utf-8'))
+    dataStart = 16+length
+    end = f.seek(0,os.SEEK_END)
+    if end-dataStart >= footer.size:
+        f.seek(end-footer.size)
+        indexOffset,chunks,tail = footer.unpack(f.read(footer.size))
+        if tail == indexMagic:
+            f.seek(indexOffset)
+            index = np.frombuffer(f.read(chunks*indexDtype.itemsize),dtype=indexDtype)
+            return header,index,indexOffset
+    # The file was not closed
+    if header.get('compression'):
+        index,position = _findChunks(f,dataStart,end)
+        return header,index,position
+    # The data written is taken as a single chunk
+    pointSize = np.dtype(header['dtype']).itemsize*header['channels']
+    points = (end-dataStart)//pointSize
+    index = np.array([(0,points,dataStart,points*pointSize)] if points else [],dtype=indexDtype)
+    return header,index,dataStart+points*pointSize
+
+
+class traceWriter():
+    """Writes a multi-channel timetrace to a trace file, chunk by chunk.
+    The file is only complete after close; it can be used with the with statement.
+    """
+    def __init__(self,filename,channels=None,accuracy=None,dtype=np.float64,names=None,metadata=None,
+                 chunk=2**16,append=False,compression=None,filters=None,level=None):
+        """filename -- the file where to write.
+        channels -- number of channels.
+        accuracy -- time between points in seconds.
+        dtype -- type of the data stored, for example np.int16 for the raw values of the card.
+        names -- optional, list with the name of every channel.
+        metadata -- optional, dictionary with any other description of the data. It has to be serializable to json.
+        chunk -- maximum number of points per channel in every chunk.
+        append -- if True and the file exists, the data is appended to it. The channels and the dtype have to be
+            the same of the file, the rest of the parameters are ignored.
+        compression -- None, 'zlib' or 'lzma'. Every chunk is compressed on its own.
+        filters -- list with the filters applied before compressing, 'delta' and/or 'shuffle'. If None, the
+            default for the dtype, see defaultFilters.
+        level -- level of compression, from 0 to 9. If None, the default of the compression, that favours speed.
+        """
+        self.filename = filename
+        self.chunk = int(chunk)
+        if append and os.path.exists(filename):
+            self.f = open(filename,'r+b')
+            self.header,index,indexOffset = _readStructure(self.f)
+            if channels is not None and channels != self.header['channels']:
+                raise Exception('%s has %s channels, not %s'%(filename,self.header['channels'],channels))
+            if np.dtype(dtype).str != self.header['dtype']:
+                raise Exception('%s holds %s data, not %s'%(filename,self.header['dtype'],np.dtype(dtype).str))
+            self.index = [tuple(int(v) for v in i) for i in index]
+            self.points = int(index['start'][-1]+index['points'][-1]) if len(index) else 0
+            self.f.seek(indexOffset)
+            self.f.truncate()
+        else:
+            self.header = {'format':'UUTrap trace','version':1,
+                           'channels':int(channels),
+                           'dtype':np.dtype(dtype).str,
+                           'accuracy':accuracy,
+                           'names':names if names is not None else ['%s'%i for i in range(channels)],
+                           'created':datetime.now().isoformat(),
+                           'metadata':metadata or {}}
+            if compression is not None:
+                if compression not in compressions:
+                    raise Exception('Unknown compression %s, use one of %s'%(compression,', '.join(compressions)))
+                self.header['compression'] = compression
+                self.header['filters'] = list(filters) if filters is not None else defaultFilters(dtype)
+                self.header['level'] = level if level is not None else defaultLevels[compression]
+            header = json.dumps(self.header).encode('utf-8')
+            self.f = open(filename,'wb')
+            self.f.write(magic)
+            self.f.write(struct.pack('<Q',len(header)))
+            self.f.write(header)
+            self.index = []
+            self.points = 0
+        self.channels = self.header['channels']
+        self.dtype = np.dtype(self.header['dtype'])
+        self.compression = self.header.get('compression')
+
+    def write(self,data):
+        """Appends data of shape (channels, points). It is split in chunks of at most chunk points.
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[np.newaxis,:]
+        if data.shape[0] != self.channels:
+            raise Exception('The data has %s channels, the file %s'%(data.shape[0],self.channels))
+        for start in range(0,data.shape[1],self.chunk):
+            block = np.ascontiguousarray(data[:,start:start+self.chunk].T,dtype=self.dtype)
+            if self.compression is None:
+                raw = block.data
+            else:
+                raw = encode(block,self.header['filters'],self.compression,self.header['level'])
+                self.f.write(chunkHeader.pack(block.shape[0],len(raw)))
+            offset = self.f.tell()
+            self.f.write(raw)
+            self.index.append((self.points,block.shape[0],offset,len(raw) if self.compression else block.nbytes))
+            self.points += block.shape[0]
+
+    def flush(self,sync=True):
+        """Writes the chunks written so far to the file. If the file is not closed, they are still readable.
+        sync -- if True, waits until they are physically on the disk. It is slow, use it only every some chunks.
+        """
+        self.f.flush()
+        if sync:
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        """Writes the index and closes the file.
+        """
+        if self.f is None:
+            return
+        offset = self.f.tell()
+        self.f.write(np.array(self.index,dtype=indexDtype).tobytes())
+        self.f.write(footer.pack(offset,len(self.index),indexMagic))
+        self.flush()
+        self.f.close()
+        self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+
+def writeTrace(filename,data,accuracy,names=None,metadata=None,dtype=None,chunk=2**16,compression=None,
+               filters=None,level=None):
+    """Writes a whole timetrace to a trace file.
+    data -- numpy array of shape (channels, points).
+    Other parameters as for traceWriter. If dtype is None, the dtype of data is kept.
+    """
+    data = np.atleast_2d(np.asarray(data))
+    if dtype is None:
+        dtype = data.dtype
+    with traceWriter(filename,data.shape[0],accuracy,dtype,names,metadata,chunk,compression=compression,
+                     filters=filters,level=level) as writer:
+        writer.write(data)
+
+
+class traceReader():
+    """Reads a trace file. Only the chunks needed are read.
+    When the chunks are one after the other, as written by traceWriter, the data is also available without
+    reading it through a memory map (see view and blocks): opening a file does not depend on its size, and files
+    larger than the memory can be analysed block by block.
+    The chunks of compressed files are decompressed in parallel by several threads.
+    """
+    def __init__(self,filename,threads=None):
+        """threads -- number of threads that decompress the chunks of compressed files. If None, one per core.
+        """
+        self.filename = filename
+        self.f = open(filename,'rb')
+        self.lock = threading.Lock()
+        self._mmap = None
+        self.threads = threads or os.cpu_count() or 1
+        self._pool = None
+        self.header,self.index,indexOffset = _readStructure(self.f)
+        self.channels = self.header['channels']
+        self.dtype = np.dtype(self.header['dtype'])
+        self.accuracy = self.header['accuracy']
+        self.names = self.header['names']
+        self.metadata = self.header['metadata']
+        self.compression = self.header.get('compression')
+        self.points = int(self.index['start'][-1]+self.index['points'][-1]) if len(self.index) else 0
+
+    def __len__(self):
+        return self.points
+
+    @property
+    def shape(self):
+        return (self.channels,self.points)
+
+    @property
+    def contiguous(self):
+        """True if the chunks are stored one after the other, i.e. the data can be memory mapped.
+        """
+        if len(self.index) == 0 or self.compression is not None:
+            return False
+        return bool(np.all(self.index['offset'][1:] == self.index['offset'][:-1]+self.index['nbytes'][:-1]))
+
+    @property
+    def mmap(self):
+        """Memory map of shape (points, channels) with all the data, or None if it can not be mapped.
+        Nothing is read until it is used.
+        """
+        if self._mmap is None and self.contiguous:
+            self._mmap = np.memmap(self.filename,dtype=self.dtype,mode='r',offset=int(self.index['offset'][0]),
+                                   shape=(self.points,self.channels))
+        return self._mmap
+
+    def view(self,start=0,stop=None,channels=None):
+        """Returns the data between the points start and stop without reading it, as a view of the memory map.
+        channels -- optional, a channel, a slice or a list of channels. A list gives a copy, not a view.
+        Returns an array of shape (channels, points), or (points,) for a single channel.
+        If the file can not be memory mapped, the data is read.
+        """
+        if self.mmap is None:
+            if isinstance(channels,int):
+                return self.read(start,stop,[channels])[0]
+            if isinstance(channels,slice):
+                channels = list(range(self.channels))[channels]
+            return self.read(start,stop,channels)
+        if channels is None:
+            channels = slice(None)
+        return self.mmap[start:stop,channels].T
+
+    def blocks(self,points,overlap=0,channels=None,volts=False):
+        """Iterates over the data in blocks of the given number of points, each one as an array of shape
+        (channels, points). Only one block is in memory at a time.
+        overlap -- points shared by consecutive blocks.
+        channels -- optional, list with the channels.
+        volts -- if True the raw values of the card are converted to volts, see volts.
+        """
+        points = int(points)
+        advance = max(points-int(overlap),1)
+        for start in range(0,max(self.points-int(overlap),1),advance):
+            if volts:
+                yield self.volts(start,start+points,channels)
+            elif self.mmap is not None:
+                yield self.view(start,start+points,channels)
+            else:
+                yield self.read(start,start+points,channels)
+
+    def readChunk(self,i):
+        """Returns the chunk i as an array of shape (points, channels).
+        """
+        start,points,offset,nbytes = self.index[i]
+        with self.lock:
+            self.f.seek(offset)
+            raw = self.f.read(nbytes)
+        if self.compression is not None:
+            # The lock is not needed any more, other threads can read while this chunk is decompressed
+            return decode(raw,int(points),self.channels,self.dtype,self.header['filters'],self.compression)
+        return np.frombuffer(raw,dtype=self.dtype).reshape(int(points),self.channels)
+
+    def map(self,function,chunks):
+        """Returns the results of function for every chunk in chunks, a list of indices. Compressed chunks are
+        read and decompressed in parallel.
+        """
+        if self.compression is None or self.threads == 1 or len(chunks) < 2:
+            return [function(i) for i in chunks]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.threads)
+        return list(self._pool.map(function,chunks))
+
+    def read(self,start=0,stop=None,channels=None):
+        """Returns the data between the points start and stop.
+        channels -- optional, list with the channels to read. By default all of them.
+        Returns a numpy array of shape (channels, points).
+        """
+        start,stop,step = slice(start,stop).indices(self.points)
+        if channels is None:
+            channels = list(range(self.channels))
+        out = np.empty((len(channels),max(stop-start,0)),dtype=self.dtype)
+        if stop <= start:
+            return out
+        starts = self.index['start']
+        first = np.searchsorted(starts,start,side='right')-1
+        last = np.searchsorted(starts,stop,side='left')
+        def copy(i):
+            chunkStart = int(starts[i])
+            data = self.readChunk(i)
+            a = max(start,chunkStart)
+            b = min(stop,chunkStart+data.shape[0])
+            out[:,a-start:b-start] = data[a-chunkStart:b-chunkStart,channels].T
+        self.map(copy,range(first,last))
+        return out
+
+    def volts(self,start=0,stop=None,channels=None):
+        """As read, but the raw values of the card are converted to volts if the header has the coefficients of the
+        card (metadata['coefficients'], one list per channel).
+        """
+        coefficients = self.metadata.get('coefficients')
+        if coefficients is None and self.mmap is not None:
+            return np.array(self.view(start,stop,channels),dtype=np.float64)
+        data = self.read(start,stop,channels)
+        if coefficients is None:
+            return data.astype(np.float64)
+        if channels is None:
+            channels = list(range(self.channels))
+        out = np.empty(data.shape)
+        for i,c in enumerate(channels):
+            scale(data[i],coefficients[c],out[i])
+        return out
+
+    def chunks(self):
+        """Iterates over the chunks, each one as an array of shape (channels, points).
+        """
+        step = self.threads if self.compression is not None else 1
+        for first in range(0,len(self.index),step):
+            # Only as many chunks as threads are decompressed ahead
+            for data in self.map(self.readChunk,range(first,min(first+step,len(self.index)))):
+                yield data.T
+
+    def close(self):
+        self._mmap = None
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
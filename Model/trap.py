@@ -3,6 +3,15 @@
 import yaml
 import numpy as np
 
+from Model.acquisition import ringBuffer, acquisitionThread
+from Model.rawtrace import rawTrace
+from Model.scan import rasterWaveform, binPixels
+from Model.recording import recordingThread
+from Model import tracefile
+
+# Types of cards that share the interface of niDAQ. 'sim' is the simulated card (see Controller/devices/simulated.py)
+analogCards = ('ni','sim')
+
 class Trap():
     def __init__(self,_session):
         """Class trap for condensing tasks that can be used for interacting with an optical trap.
@@ -13,7 +22,9 @@ class Trap():
         stream = open(_session.task_conf,'r')
         self.tasks = yaml.load(stream)['task']
         self.monitorNum = []
-        if self._session.adq['type'] == 'ni':
+        self.monitorThread = None
+        self.recording = None
+        if self._session.adq['type'] in analogCards:
             self.adq = _session.adq['adq']
         else:
             raise Exception('Other types of cards not implemented for acquireAnalog')
@@ -22,7 +33,7 @@ class Trap():
         """Triggers an analog measurement. It does not read the value.
         conditions -- a dictionary with the needed parameters for an analog acquisition.
         """
-        if self._session.adq['type'] == 'ni':
+        if self._session.adq['type'] in analogCards:
             self.adq.analogSetup(conditions['channel'],conditions['points'],conditions['accuracy'],conditions['limits'])
             self.adq.analogTrigger() # Starts the measurement.
             self.running = True
@@ -33,65 +44,103 @@ class Trap():
         """Gets the analog values acquired with the triggerAnalog function.
         conditions -- dictionary with the number of points ot be read
         """
-        if self._session.adq['type'] == 'ni':
+        if self._session.adq['type'] in analogCards:
             return self.adq.analogRead(conditions['points'])
         else:
             raise Exception('Other types of cards not implemented for getAnalog')
 
     def startMonitor(self,conditions):
         """Starts continuous acquisition of the specified channels with the specified timing interval.
+        The card is read in the background by an acquisitionThread that stores the data in a ringBuffer,
+        see readMonitor and latestMonitor for getting the data.
         conditions['devs'] -- list of devices to monitor
         conditions['accuracy'] -- accuracy for the monitor. If not defined defaults to 0.1s
+        conditions['time'] -- optional, time kept in the ring buffer in seconds. Defaults to the monitor time.
         """
         self.monitorTask = self.tasks['Monitor']
-        channels = []
         if conditions['accuracy']>0:
             accuracy = conditions['accuracy']
         else:
             accuracy = 0.1 # 100 milliseconds
-        if self._session.adq['type'] == 'ni':
+        if self._session.adq['type'] in analogCards:
             if type(conditions['devs']) == type(""):
                 conditions['devs'] = [conditions['devs']]
-            for dev in conditions['devs']:
-                self.devsMonitor = len(conditions['devs'])
-                if dev.properties['Type'] == 'Analog':
-                    channels.append(dev.properties['Input']['Hardware']['PortID'])
-                    limitmax = dev.properties['Input']['Limits']['Max']
-                    limitmin = dev.properties['Input']['Limits']['Min']
-                    # print('Channel: %s'%channels[-1])
-                    # print('--- Limit Max: %s'%limitmax)
-                    # print('--- Limit Min: %s'%limitmin)
+            self.devsMonitor = len(conditions['devs'])
+            channels,limits = self.analogChannels(conditions['devs']) # Every channel keeps the limits of its device
 
-            self.monitorNum = self.adq.analogSetup(self.monitorTask,channels,0,accuracy,(limitmin,limitmax))
+            block = self._session.monitorBlock/1000 # In seconds
+            blockPoints = max(int(block/accuracy),1)
+            refresh = self._session.monitorRefresh/1000 # In seconds
+            keep = max(conditions.get('time',self._session.monitorTime),10*refresh)
+            self.monitorNum = self.adq.analogSetup(self.monitorTask,channels,0,accuracy,limits,blockPoints*accuracy)
+            self.monitorBuffer = ringBuffer(len(channels),keep/accuracy)
+            self.monitorCount = 0
+            self.monitorAccuracy = accuracy
             #for mon in self.monitorNum:
             self.adq.analogTrigger(self.monitorNum)
+            self.monitorThread = acquisitionThread(self.adq,self.monitorNum,self.monitorBuffer,blockPoints,2*block+1)
+            self.monitorThread.start()
+
+    def checkMonitor(self):
+        """Raises the exception that stopped the acquisition thread of the monitor, if any.
+        """
+        if self.monitorThread is not None and self.monitorThread.error is not None:
+            raise self.monitorThread.error
 
     def readMonitor(self):
-        """Reads the monitor values of all the channels specified.
+        """Reads the monitor values acquired since the previous read.
+        Returns a numpy array of shape (channels, points). It is a view of the ring buffer of the monitor,
+        it has to be copied if it is needed after the ring buffer wraps around.
         """
-        val,data = self.adq.analogRead(self.monitorNum,-1)
-        return data[:val*self.devsMonitor]
+        self.checkMonitor()
+        data,self.monitorCount = self.monitorBuffer.since(self.monitorCount)
+        return data
+
+    def latestMonitor(self,seconds):
+        """Returns a view of shape (channels, points) with the latest seconds of the monitor.
+        It does not change what readMonitor returns.
+        """
+        self.checkMonitor()
+        return self.monitorBuffer.latest(int(seconds/self.monitorAccuracy))
 
     def stopMonitor(self):
         """Stops all the tasks related to the monitor.
         """
-        if self._session.adq['type'] == 'ni':
+        if self._session.adq['type'] in analogCards:
+            if self.monitorThread is not None:
+                self.monitorThread.stop()
+                self.monitorThread = None
             self.adq.clear(self.monitorNum)
 
+    def releaseTasks(self):
+        """Releases all the tasks that the card keeps configured.
+        """
+        if self._session.adq['type'] in analogCards:
+            self.adq.releaseAll()
+
     def fastTimetrace(self,conditions):
         """ Acquires a fast timetrace of the selected devices.
         conditions['devs'] -- list of devices to monitor
         conditions['accuracy'] -- accuracy in milliseconds.
         conditions['time'] -- total time of acquisition for each channel in seconds.
+        conditions['simultaneous'] -- if True all the devices are acquired in a single hardware-timed task and
+                                      a numpy array of shape (channels, points) is returned. Defaults to False,
+                                      in which case the devices are acquired one after the other.
+        conditions['raw'] -- if True the data is kept as the int16 values of the card and a rawTrace is returned.
+                             It is converted to volts only when needed. Defaults to False.
         """
 
         points = int(conditions['time']*1000/conditions['accuracy'])
 
         self.highSpeedTask = self.tasks['highSpeed']
-        if self._session.adq['type'] == 'ni':
+        if self._session.adq['type'] in analogCards:
             if type(conditions['devs']) == type(""):
                 conditions['devs'] = [conditions['dev']]
+            if conditions.get('simultaneous',False):
+                return self.fastTimetraceSimultaneous(conditions)
+            raw = conditions.get('raw',False)
             data = []
+            coeffs = []
             for dev in conditions['devs']:
                 self.devsMonitor = len(conditions['devs'])
                 if dev.properties['Type'] == 'Analog':
@@ -100,7 +149,170 @@ class Trap():
                     limitmin = dev.properties['Input']['Limits']['Min']
                     self.highSpeedNum = self.adq.analogSetup(self.highSpeedTask,channel,points,conditions['accuracy']/1000,(limitmin,limitmax))
                     self.adq.analogTrigger(self.highSpeedNum)
-                    v,d = self.adq.analogRead(self.highSpeedNum,points,conditions['time'])
+                    if raw:
+                        v,d = self.adq.analogReadBinary(self.highSpeedNum,points,conditions['time'])
+                        coeffs.append(self.adq.scalingCoefficients(self.highSpeedNum)[0])
+                    else:
+                        v,d = self.adq.analogRead(self.highSpeedNum,points,conditions['time'])
                     self.adq.clear(self.highSpeedNum)
                     data.append(np.array(d))
+            if raw:
+                return rawTrace(np.array(data),coeffs,conditions['accuracy']/1000)
             return data
+
+    def analogChannels(self,devs):
+        """Returns the list of channels of the analog devices and the list with their limits.
+        devs -- list of devices
+        """
+        channels = []
+        limits = []
+        for dev in devs:
+            if dev.properties['Type'] == 'Analog':
+                channels.append(dev.properties['Input']['Hardware']['PortID'])
+                limitmax = dev.properties['Input']['Limits']['Max']
+                limitmin = dev.properties['Input']['Limits']['Min']
+                limits.append((limitmin,limitmax))
+        return channels,limits
+
+    def fastTimetraceSimultaneous(self,conditions):
+        """ Acquires a fast timetrace of all the selected devices in a single task.
+        The channels share the sample clock of the card, therefore the traces are aligned in time.
+        Each channel keeps the limits defined for its device.
+        conditions -- same as for fastTimetrace
+        Returns a numpy array of shape (channels, points), or a rawTrace if conditions['raw'] is True.
+        """
+        self.triggerFastTimetrace(conditions)
+        return self.readFastTimetrace(conditions)
+
+    def triggerFastTimetrace(self,conditions):
+        """ Starts a fast timetrace of all the selected devices in a single task, without waiting for it.
+        The card acquires in the background until the data is read with readFastTimetrace.
+        conditions -- same as for fastTimetrace
+        """
+        self.highSpeedTask = self.tasks['highSpeed']
+        points = int(conditions['time']*1000/conditions['accuracy'])
+        channels,limits = self.analogChannels(conditions['devs'])
+        self.devsMonitor = len(channels)
+        self.highSpeedNum = self.adq.analogSetup(self.highSpeedTask,channels,points,conditions['accuracy']/1000,limits)
+        self.adq.analogTrigger(self.highSpeedNum)
+
+    def readFastTimetrace(self,conditions,out=None):
+        """ Waits for the timetrace started with triggerFastTimetrace and reads it.
+        conditions -- same as for triggerFastTimetrace
+        out -- optional numpy array of shape (channels, points) where to store the data. Not used for raw data.
+        Returns a numpy array of shape (channels, points), or a rawTrace if conditions['raw'] is True.
+        """
+        points = int(conditions['time']*1000/conditions['accuracy'])
+        channels = self.devsMonitor
+        if conditions.get('raw',False):
+            v,d = self.adq.analogReadBinary(self.highSpeedNum,points,conditions['time'])
+            coeffs = self.adq.scalingCoefficients(self.highSpeedNum)
+        elif out is not None:
+            v,d = self.adq.analogRead(self.highSpeedNum,points,conditions['time'],out.reshape(-1))
+        else:
+            v,d = self.adq.analogRead(self.highSpeedNum,points,conditions['time'])
+        self.adq.clear(self.highSpeedNum)
+        # The data comes grouped by channel, i.e. [ch0 points, ch1 points, ...]
+        data = np.reshape(d[:v*channels],(channels,v))
+        if conditions.get('raw',False):
+            return rawTrace(data,coeffs,conditions['accuracy']/1000)
+        return data
+
+    def startRecording(self,conditions):
+        """ Starts recording a long timetrace of the selected devices directly to disk.
+        The card is read in chunks by a recordingThread, that appends them to a trace file together with the
+        description of the data (see Model/tracefile.py).
+        conditions['devs'] -- list of devices to record
+        conditions['accuracy'] -- accuracy in milliseconds.
+        conditions['time'] -- total time of acquisition in seconds.
+        conditions['filename'] -- the file where to store the data.
+        conditions['chunk'] -- optional, time of every chunk in seconds. Defaults to 0.5s.
+        conditions['raw'] -- optional, if True the data is stored as the int16 values of the card.
+        conditions['append'] -- optional, if True and the file exists the data is appended to it.
+        """
+        if self._session.adq['type'] in analogCards:
+            if type(conditions['devs']) != type([]):
+                conditions['devs'] = [conditions['devs']]
+            channels,limits = self.analogChannels(conditions['devs'])
+            accuracy = conditions['accuracy']/1000 # In seconds
+            points = int(conditions['time']*1000/conditions['accuracy'])
+            chunk = max(int(conditions.get('chunk',.5)/accuracy),1)
+            raw = conditions.get('raw',False)
+            self.recordingNum = self.adq.analogSetup(self.tasks['highSpeed'],channels,0,accuracy,limits,chunk*accuracy)
+            devs = [dev for dev in conditions['devs'] if dev.properties['Type'] == 'Analog']
+            names = [dev.properties['Name'] for dev in devs]
+            metadata = {'time':conditions['time'], # In seconds
+                        'limits':limits,
+                        'devices':tracefile.deviceParameters(devs),
+                        'session':tracefile.sessionParameters(self._session)}
+            if raw:
+                # The raw values of the card are stored, with the coefficients for converting them to volts
+                metadata['coefficients'] = self.adq.scalingCoefficients(self.recordingNum).tolist()
+            self.recording = recordingThread(self.adq,self.recordingNum,len(channels),points,chunk,conditions['filename'],
+                                             raw,2*chunk*accuracy+1,accuracy,names,metadata,conditions.get('append',False))
+            self.adq.analogTrigger(self.recordingNum)
+            self.recording.start()
+        else:
+            raise Exception('Other types of cards not implemented for startRecording')
+
+    def recordingStats(self):
+        """Returns the running statistics of the current recording, see runningStats.get. They are in the units
+        stored in the file, i.e. raw values of the card when recording with conditions['raw'].
+        The number of points per channel already stored is in 'recorded' and the recording is finished when 'running' is False.
+        """
+        if self.recording is None:
+            return None
+        if self.recording.error is not None:
+            raise self.recording.error
+        stats = self.recording.stats.get()
+        stats['recorded'] = self.recording.recorded
+        stats['running'] = self.recording.is_alive()
+        return stats
+
+    def stopRecording(self):
+        """Stops the recording, if it is still running, and the task of the card.
+        """
+        if self.recording is not None:
+            self.recording.stop()
+            self.recording = None
+
+    def rasterScan(self,conditions):
+        """ Bidirectional raster scan of the piezo stage.
+        The whole waveform of the piezo is written to a buffered analog output that runs on the sample clock
+        of the analog inputs, therefore every sample is acquired at a known position of the stage.
+        conditions['devs'] -- list of devices to acquire during the scan
+        conditions['outputs'] -- optional, analog outputs of the (fast, slow) axes. Defaults to (0, 1), i.e. ao0 and ao1.
+        conditions['center'] -- tuple with the voltages (fast, slow) of the center of the scan
+        conditions['range'] -- range of the scan in volts
+        conditions['pixels'] -- number of pixels per line and number of lines
+        conditions['samplesPerPixel'] -- number of samples averaged in every pixel
+        conditions['accuracy'] -- time between samples in milliseconds
+        Returns two numpy arrays of shape (channels, pixels, pixels) with the forward and backward images.
+        """
+        if self._session.adq['type'] in analogCards:
+            if type(conditions['devs']) != type([]):
+                conditions['devs'] = [conditions['devs']]
+            scanTask = self.tasks.get('scan',2)
+            outputs = list(conditions.get('outputs',(0,1)))
+            pixels = int(conditions['pixels'])
+            samplesPerPixel = int(conditions['samplesPerPixel'])
+            accuracy = conditions['accuracy']/1000 # In seconds
+            waveform = rasterWaveform(conditions['center'],conditions['range'],pixels,samplesPerPixel)
+            if np.min(waveform) < 0 or np.max(waveform) > 10:
+                raise Exception('The scan goes outside the range of the piezo (0-10V)')
+            points = waveform.shape[1]
+            channels,limits = self.analogChannels(conditions['devs'])
+            outputNum = self.adq.analogOutputSetup(scanTask,outputs,points,accuracy,(0.0,10.0),self.adq.aiClock())
+            self.adq.analogWrite(outputNum,waveform)
+            inputNum = self.adq.analogSetup(scanTask,channels,points,accuracy,limits)
+            self.adq.analogTrigger(outputNum) # Waits for the sample clock of the inputs
+            self.adq.analogTrigger(inputNum)
+            v,d = self.adq.analogRead(inputNum,points,points*accuracy*1.05+1)
+            self.adq.clear(inputNum)
+            self.adq.clear(outputNum)
+            if v != points:
+                raise Exception('Only %s of %s points were acquired during the scan'%(v,points))
+            data = np.reshape(d[:v*len(channels)],(len(channels),v))
+            return binPixels(data,pixels,samplesPerPixel)
+        else:
+            raise Exception('Other types of cards not implemented for rasterScan')
@@ -0,0 +1,56 @@
+"""Calibrates all the power spectra saved in a directory, using all the cores of the computer.
+The files saved by the Power Spectra window are searched in the directory and in its subdirectories
+(one per date), and the results are written to a single table in csv format, one row per file and one group of
+columns per channel. The channels are identified by the names stored in the files, i.e. the devices recorded.
+Usage:
+    python Scripts/batchCalibration.py G:/Data results.csv
+"""
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from Model.calibration import findPowerSpectraFiles, calibrateFiles
+
+columns = ['fc','fcErr','D','DErr','kappa','kappaErr','beta','betaErr']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrates all the power spectra saved in a directory.')
+    parser.add_argument('directory',help='directory with the data, for example the saveDirectory of the session')
+    parser.add_argument('output',help='csv file where to write the results')
+    parser.add_argument('--processes',type=int,default=None,help='number of processes, one per core by default')
+    parser.add_argument('--nperseg',type=int,default=16384,help='points per segment of the power spectra')
+    parser.add_argument('--fastlength',choices=['pad','truncate'],default=None,
+                        help='zero-pads or truncates the segments to a length fast to transform')
+    parser.add_argument('--bins',type=int,default=20,help='bins per decade of the spectra used in the fit')
+    parser.add_argument('--fmin',type=float,default=10,help='lowest frequency of the fit, in Hz')
+    parser.add_argument('--fmax',type=float,default=None,help='highest frequency of the fit, in Hz')
+    parser.add_argument('--aliasing',action='store_true',help='corrects the fit for the aliasing')
+    parser.add_argument('--radius',type=float,default=0.5e-6,help='radius of the bead in m')
+    args = parser.parse_args()
+
+    files = findPowerSpectraFiles(args.directory)
+    print('Calibrating %s files'%len(files))
+    results = calibrateFiles(files,args.processes,nperseg=args.nperseg,fastLength=args.fastlength,binsPerDecade=args.bins,fmin=args.fmin,
+                             fmax=args.fmax,aliasing=args.aliasing,radius=args.radius)
+
+    # The channels of all the files, in the order they first appear
+    names = []
+    for filename,calibration,error in results:
+        if calibration is not None:
+            names += [n for n in calibration['names'] if n not in names]
+    header = ['date','file']+['%s_%s'%(c,n) for n in names for c in columns]
+    with open(args.output,'w') as f:
+        f.write(','.join(header)+'\n')
+        for filename,calibration,error in results:
+            date = os.path.basename(os.path.dirname(filename))
+            if calibration is None:
+                print('Error with %s: %s'%(filename,error))
+                values = [np.nan]*len(names)*len(columns)
+            else:
+                channels = calibration['names']
+                values = [calibration[c][channels.index(n)] if n in channels else np.nan
+                          for n in names for c in columns]
+            f.write(','.join([date,os.path.basename(filename)]+['%.6g'%v for v in values])+'\n')
+    print('Results saved in %s'%args.output)
@@ -0,0 +1,65 @@
+"""Compares the compressions of the trace files on synthetic timetraces of a trapped bead.
+The signal of every channel is an Ornstein-Uhlenbeck process plus the noise of the detector, digitized by a 16 bits
+card, stored both as the raw values of the card (int16) and as volts (float64). For every compression and filters
+(see Model.tracefile) it gives the ratio between the size of the data and the size of the file, and the speed of
+writing and of reading the whole file with one thread and with one per core.
+Usage:
+    python Scripts/benchmarkCompression.py [points]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from Model import tracefile
+from Controller.devices.simulated import ornsteinUhlenbeck
+
+channels = 3
+accuracy = 1e-5 # In seconds
+cornerFrequency = 500 # In Hz
+amplitude = 1. # Standard deviation of the position of the bead, in volts
+noise = 2e-3 # Noise of the detector, in volts
+voltsRange = 10. # The card measures between -voltsRange and voltsRange
+configurations = [(None,None),
+                  ('zlib',[]),('zlib',['shuffle']),('zlib',['delta']),('zlib',['delta','shuffle']),
+                  ('lzma',[]),('lzma',['shuffle']),('lzma',['delta']),('lzma',['delta','shuffle'])]
+
+def brownian(points,rng):
+    """Returns the raw values of the card and the volts of the synthetic timetraces.
+    """
+    a = np.full(channels,np.exp(-2*np.pi*cornerFrequency*accuracy))
+    sigma = amplitude*np.sqrt(1-a**2)
+    data = ornsteinUhlenbeck(np.zeros(channels),a,sigma,points,rng)+noise*rng.standard_normal((channels,points))
+    raw = np.clip(np.round(data/voltsRange*32768),-32768,32767).astype(np.int16)
+    return raw,raw*(voltsRange/32768)
+
+def measure(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter()-start
+
+if __name__ == '__main__':
+    points = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**6
+    raw,volts = brownian(points,np.random.RandomState(0))
+    cores = os.cpu_count() or 1
+    filename = os.path.join(tempfile.mkdtemp(),'benchmark'+tracefile.extension)
+    print('%8s %6s %15s %8s %14s %14s %14s'%('dtype','codec','filters','ratio','write (MB/s)','read 1 (MB/s)',
+                                             'read %s (MB/s)'%cores))
+    for data in (raw,volts):
+        megabytes = data.nbytes/1e6
+        for compression,filters in configurations:
+            write = measure(lambda: tracefile.writeTrace(filename,data,accuracy,compression=compression,
+                                                         filters=filters))
+            ratio = data.nbytes/os.path.getsize(filename)
+            speeds = []
+            for threads in (1,cores):
+                with tracefile.traceReader(filename,threads) as reader:
+                    speeds.append(megabytes/measure(reader.read))
+                    if not np.array_equal(reader.read(),data):
+                        raise Exception('The data read is not the data written')
+            print('%8s %6s %15s %8.2f %14.1f %14.1f %14.1f'%(data.dtype,compression,
+                                                            '+'.join(filters) if filters else '-',ratio,
+                                                            megabytes/write,speeds[0],speeds[1]))
+    os.remove(filename)
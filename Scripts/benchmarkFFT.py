@@ -0,0 +1,36 @@
+"""Compares the time needed for the power spectra of typical timetraces with the different FFT backends.
+The lengths are those of highSpeedTime/highSpeedAccuracy plus a few points, which are slow to transform,
+and the lengths obtained zero-padding them (see Model.fftbackend.fastLength).
+Usage:
+    python Scripts/benchmarkFFT.py
+"""
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from Model import fftbackend
+from Model.spectra import welch
+
+channels = 3
+lengths = [10**5+3,10**6+3,10**7+3]
+repeat = 3
+
+def best(function):
+    return min(timeit.repeat(function,number=1,repeat=repeat))
+
+if __name__ == '__main__':
+    configurations = [('numpy',1)]
+    if fftbackend._scipyfft is not None:
+        configurations += [('scipy',1),('scipy',-1)]
+    print('%10s %8s %8s %12s %12s %12s'%('points','backend','workers','whole (s)','padded (s)','welch (s)'))
+    for n in lengths:
+        data = np.random.standard_normal((channels,n))
+        padded = fftbackend.nextFastLength(n)
+        for backend,workers in configurations:
+            fftbackend.setBackend(backend,workers)
+            whole = best(lambda: fftbackend.rfft(data,axis=-1))
+            pad = best(lambda: fftbackend.rfft(data,padded,axis=-1))
+            segmented = best(lambda: welch(data,1e-5,16384))
+            print('%10s %8s %8s %12.4f %12.4f %12.4f'%(n,backend,workers,whole,pad,segmented))
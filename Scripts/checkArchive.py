@@ -0,0 +1,60 @@
+"""Checks the retention and the compaction of the archive of runs (see Model.archive).
+Archives more runs than the index keeps before it is compacted, with a limit of size that holds only a few runs,
+and verifies after every run that the oldest runs are deleted, that the index is compacted, and that the runs
+left are found and read, also after opening the archive again.
+Usage:
+    python Scripts/checkArchive.py [runs]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from Model.archive import runArchive, headerSize, recordDtype
+
+kept = 5 # Runs that fit in the archive
+points = 100
+
+def check(condition,message):
+    if not condition:
+        raise Exception(message)
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 2500
+    directory = tempfile.mkdtemp()
+    try:
+        data = np.zeros((2,points),dtype=np.int16)
+        archive = runArchive(directory)
+        archive.add(data,1e-5,psd=(np.arange(3.),np.ones((2,3))),timestamp=1000.)
+        runBytes = archive.totalBytes
+        shutil.rmtree(directory)
+        archive = runArchive(directory,maxBytes=kept*runBytes)
+        compactions = 0
+        first = 0
+        for i in range(runs):
+            data[:] = i
+            record = archive.add(data,1e-5,psd=(np.arange(3.),np.ones((2,3))*i),timestamp=1000.+i)
+            check(record['id'] == i,'Run %s got the number %s'%(i,record['id']))
+            records = archive.records
+            check(len(records) == min(i+1,kept),'%s runs archived after %s, not %s'%(len(records),i+1,kept))
+            check(records['id'][-1] == i and records['id'][0] == max(i+1-kept,0),'Wrong runs kept after %s'%i)
+            if archive.first < first:
+                compactions += 1
+            first = archive.first
+            indexRecords = (os.path.getsize(archive.indexFile)-headerSize)//recordDtype.itemsize
+            check(indexRecords <= 1024+kept+1,'The index holds %s records, it was not compacted'%indexRecords)
+        files = [f for f in os.listdir(directory) if f.startswith('run_')]
+        check(len(files) == 2*kept,'%s files left, not %s'%(len(files),2*kept))
+        check(compactions > 0,'The index was never compacted')
+        archive = runArchive(directory,maxBytes=kept*runBytes)
+        found = archive.find(1000.+runs-3,None)
+        check(list(found['id']) == list(range(runs-3,runs)),'Wrong runs found: %s'%found['id'])
+        for record in found:
+            with archive.open(record) as reader:
+                check(np.all(reader.read() == record['id']),'Wrong data in run %s'%record['id'])
+            check(np.all(archive.psd(record)[1] == record['id']),'Wrong power spectra in run %s'%record['id'])
+        print('%s runs archived, %s kept, index compacted %s times: OK'%(runs,kept,compactions))
+    finally:
+        shutil.rmtree(directory)
@@ -1,49 +1,33 @@
+import numpy as np
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui
 
 
 class monitorWidget(QtGui.QWidget):
     """ Widget for displaying the Timetraces.
+        There is a plot of the timetrace and a plot of the variance for every device. The devices are placed
+        in columns of at most maxRows devices.
     """
-    def __init__(self,parent=None):
+    def __init__(self,devices,maxRows=4,parent=None):
+        """devices -- list of the devices monitored.
+        maxRows -- maximum number of devices in every column.
+        """
         QtGui.QWidget.__init__(self, parent)
 
-        # Timetraces
-        qpdx = pg.PlotWidget()
-        qpdy = pg.PlotWidget()
-        qpdz = pg.PlotWidget()
-
-        varx = pg.PlotWidget()
-        vary = pg.PlotWidget()
-        varz = pg.PlotWidget()
-
-        qpdx.setLabel('left', "QPD X", units='V')
-        qpdx.setLabel('bottom', "Time", units='s')
-        qpdy.setLabel('left', "QPD Y", units='V')
-        qpdy.setLabel('bottom', "Time", units='s')
-        qpdz.setLabel('left', "QPD Z", units='V')
-        qpdz.setLabel('bottom', "Time", units='s')
-
-        varx.setLabel('left', "VAR X", units='V')
-        varx.setLabel('bottom', "Time", units='s')
-        vary.setLabel('left', "VAR Y", units='V')
-        vary.setLabel('bottom', "Time", units='s')
-        varz.setLabel('left', "VAR Z", units='V')
-        varz.setLabel('bottom', "Time", units='s')
-
-        self.qpdx = qpdx
-        self.qpdy = qpdy
-        self.qpdz = qpdz
-        self.varx = varx
-        self.vary = vary
-        self.varz = varz
-
-        # Layout
+        self.traces = [] # Plots of the timetraces
+        self.variances = [] # Plots of the variances
         self.layout = QtGui.QGridLayout(self)
-        self.layout.addWidget(self.qpdx, 0, 0)
-        self.layout.addWidget(self.qpdy, 1, 0)
-        self.layout.addWidget(self.qpdz, 2, 0)
-
-        self.layout.addWidget(self.varx, 0, 1)
-        self.layout.addWidget(self.vary, 1, 1)
-        self.layout.addWidget(self.varz, 2, 1)
+        columns = int(np.ceil(len(devices)/maxRows))
+        rows = int(np.ceil(len(devices)/max(columns,1)))
+        for i,dev in enumerate(devices):
+            name = dev.properties.get('Description',dev.properties.get('Name',''))
+            trace = pg.PlotWidget()
+            trace.setLabel('left', name, units='V')
+            trace.setLabel('bottom', "Time", units='s')
+            var = pg.PlotWidget()
+            var.setLabel('left', "VAR %s"%name, units='V')
+            var.setLabel('bottom', "Time", units='s')
+            self.layout.addWidget(trace, i%rows, 2*(i//rows))
+            self.layout.addWidget(var, i%rows, 2*(i//rows)+1)
+            self.traces.append(trace)
+            self.variances.append(var)
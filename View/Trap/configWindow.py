@@ -30,6 +30,11 @@ class configWindow(QtGui.QWidget):
         self.highSpeedAccuracy_label.setAlignment(QtCore.Qt.AlignRight)
         self.highSpeedAccuracy = QtGui.QLineEdit(self)
         self.highSpeedAccuracy.setText(str(_session.highSpeedAccuracy))
+        self.highSpeedSegment_label = QtGui.QLabel(self)
+        self.highSpeedSegment_label.setText('Segment (points): ')
+        self.highSpeedSegment_label.setAlignment(QtCore.Qt.AlignRight)
+        self.highSpeedSegment = QtGui.QLineEdit(self)
+        self.highSpeedSegment.setText(str(_session.highSpeedSegment))
         '''==================MONITOR========================================='''
         self.monitor_title = QtGui.QLabel(self)
         self.monitor_title.setText('Monitor')
@@ -67,22 +72,25 @@ class configWindow(QtGui.QWidget):
         self.layout.addWidget(self.highSpeedTime,1,1)
         self.layout.addWidget(self.highSpeedAccuracy_label,2,0)
         self.layout.addWidget(self.highSpeedAccuracy,2,1)
-        self.layout.addWidget(self.monitor_title,3,0,1,0)
-        self.layout.addWidget(self.monitorTime_label,4,0)
-        self.layout.addWidget(self.monitorTime,4,1)
-        self.layout.addWidget(self.monitorTimeresol_label,5,0)
-        self.layout.addWidget(self.monitorTimeresol,5,1)
-        self.layout.addWidget(self.monitorRefresh_label,6,0)
-        self.layout.addWidget(self.monitorRefresh,6,1)
+        self.layout.addWidget(self.highSpeedSegment_label,3,0)
+        self.layout.addWidget(self.highSpeedSegment,3,1)
+        self.layout.addWidget(self.monitor_title,4,0,1,0)
+        self.layout.addWidget(self.monitorTime_label,5,0)
+        self.layout.addWidget(self.monitorTime,5,1)
+        self.layout.addWidget(self.monitorTimeresol_label,6,0)
+        self.layout.addWidget(self.monitorTimeresol,6,1)
+        self.layout.addWidget(self.monitorRefresh_label,7,0)
+        self.layout.addWidget(self.monitorRefresh,7,1)
 
-        self.layout.addWidget(self.contin_runs,7,0)
+        self.layout.addWidget(self.contin_runs,8,0)
 
-        self.layout.addWidget(self.applyButton,8,0,1,2)
-        self.layout.addWidget(self.clearMonitor,9,0,1,2)
+        self.layout.addWidget(self.applyButton,9,0,1,2)
+        self.layout.addWidget(self.clearMonitor,10,0,1,2)
 
     def setTimes(self):
         highSpeedTime = float(self.highSpeedTime.text())
         highSpeedAccuracy = float(self.highSpeedAccuracy.text())
+        highSpeedSegment = int(self.highSpeedSegment.text())
 
         monitorTime = float(self.monitorTime.text())
         monitorTimeresol = float(self.monitorTimeresol.text())
@@ -90,6 +98,7 @@ class configWindow(QtGui.QWidget):
 
         self._session.highSpeedTime = highSpeedTime
         self._session.highSpeedAccuracy = highSpeedAccuracy
+        self._session.highSpeedSegment = highSpeedSegment
         self._session.runs = self.contin_runs.isChecked()
         self._session.monitorTime = monitorTime
         self._session.monitorTimeresol = monitorTimeresol
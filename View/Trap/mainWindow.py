@@ -4,17 +4,24 @@
 import numpy as np
 import sys
 import os
-import copy
+import threading
 
 from pyqtgraph.Qt import QtGui, QtCore
 from PyQt4.Qt import QApplication
 from datetime import datetime
 
 from Model.trap import Trap
+from Model.acquisition import ringBuffer
+from Model.recording import runningStats
+from Model.decimation import envelopeBuffer
+from Model import tracefile
+from Model import fftbackend
+from Model.savewriter import saveWriter
 from View.Trap.Monitor import monitorWidget
 from View.Trap.powerSpectra import powerSpectra
 from View.Trap.configWindow import configWindow
 from View.Trap.valueMonitor import valueMonitor
+from View.Trap.renderScheduler import renderScheduler
 
 class mainWindow(QtGui.QMainWindow):
     """ Monitor of the relevant signals.
@@ -27,40 +34,38 @@ class mainWindow(QtGui.QMainWindow):
         # The class that controls the trap
         self.trap = Trap(_session)
 
+        # The devices to analize, all the monitor devices of the configuration, in order
+        self.devices = list(_session.monDevs.values())
+
         # The windows that are available
-        self.timetraces = monitorWidget()
+        self.timetraces = monitorWidget(self.devices)
         self.powerSpectra = powerSpectra(_session)
         self.configWindow = configWindow(_session)
-        self.valueMonitor = valueMonitor()
+        self.valueMonitor = valueMonitor(self.devices)
         self.setCentralWidget(self.timetraces)
 
-        # The devices to analize
-        self.devices = []
-        self.devices.append(_session.devs['qpdx'])
-        self.devices.append(_session.devs['qpdy'])
-        self.devices.append(_session.devs['qpdz'])
-
         self._session = _session
-        # Initial timetrace data
-        self.clearMonitor()
+        # Reads the monitor and computes its statistics in the background, the GUI only draws
+        self.monitor = monitorThread(self._session,self.trap,len(self.devices))
 
 
-        self.qpdx = self.timetraces.qpdx.plot(self.t[0],self.data[0],pen='y')
-        self.qpdy = self.timetraces.qpdy.plot(self.t[1],self.data[1],pen='y')
-        self.qpdz = self.timetraces.qpdz.plot(self.t[2],self.data[1],pen='y')
+        self.traceCurves = [p.plot([],[],pen='y') for p in self.timetraces.traces]
+        self.varCurves = [p.plot([],[],pen='y') for p in self.timetraces.variances]
 
-        self.varx = self.timetraces.varx.plot(self.t[0],self.data[0],pen='y')
-        self.vary = self.timetraces.vary.plot(self.t[1],self.data[1],pen='y')
-        self.varz = self.timetraces.varz.plot(self.t[2],self.data[1],pen='y')
-
-        self.ctimer = QtCore.QTimer()
         self.running = False
-
-        QtCore.QObject.connect(self.ctimer,QtCore.SIGNAL("timeout()"),self.updateMon)
-        QtCore.QObject.connect(self,QtCore.SIGNAL("TimeTraces"),self.updateTimes)
-        QtCore.QObject.connect(self,QtCore.SIGNAL("varData"),self.updateVariances)
+        # The files are written in the background
+        self.writer = saveWriter(callback=lambda filename,error: self.emit(QtCore.SIGNAL('Saved'),filename,error))
+        QtCore.QObject.connect(self,QtCore.SIGNAL('Saved'),self.saved)
+
+        # The data of the monitor is drawn by the scheduler, that skips the hidden windows and limits the frame rate
+        self.scheduler = renderScheduler(_session.monitorFps)
+        self.scheduler.register('TimeTraces',self.timetraces,self.updateTimes)
+        self.scheduler.register('varData',self.timetraces,self.updateVariances)
+        self.scheduler.register('MeanData',self.valueMonitor,self.valueMonitor.UpdateValues)
+        for name in ('TimeTraces','varData','MeanData'):
+            QtCore.QObject.connect(self.monitor,QtCore.SIGNAL(name),lambda data,name=name: self.scheduler.submit(name,data))
+        QtCore.QObject.connect(self.monitor,QtCore.SIGNAL('MonitorError'),self.monitorError)
         QtCore.QObject.connect(self.powerSpectra, QtCore.SIGNAL('Stop_Tr'),self.stop_timer)
-        QtCore.QObject.connect(self,QtCore.SIGNAL('MeanData'),self.valueMonitor.UpdateValues)
         QtCore.QObject.connect(self.configWindow,QtCore.SIGNAL('Times'),self.updateParameters)
         QtCore.QObject.connect(self.configWindow, QtCore.SIGNAL('clearMonitor'), self.clearMonitor)
 
@@ -130,85 +135,47 @@ class mainWindow(QtGui.QMainWindow):
 
     def clearMonitor(self):
         """Clears the variables associated with the monitor and starts again. """
-        self.t =[]
-        self.data = []
-        self.varData = []
-        self.varT = []
-        self.firstMon = []
-        self.firstVar = []
-        for i in range(len(self.devices)):
-            self.t.append(np.zeros([1,]))
-            self.data.append(np.zeros([1,]))
-            self.varData.append(np.zeros([1,]))
-            self.varT.append(np.zeros([1,]))
-            self.firstMon.append(True)
-            self.firstVar.append(True)
-
-    def updateMon(self):
-        """Function that gets the data from the ADQ and prepares it for updating the GUI.
+        self.monitor.clear()
+
+    def updateTimes(self,traces):
+        """Updates the plots of the timetraces.
+        traces -- array with the time in the first row and one row per device, see monitorThread.
         """
+        for i,curve in enumerate(self.traceCurves):
+            curve.setData(traces[0],traces[i+1])
 
-        final_data = self.trap.readMonitor() # Have to be sure it is an ND array
-        final_data = np.reshape(final_data, (self.trap.devsMonitor, int(len(final_data)/self.trap.devsMonitor)))
-        mean_data = np.mean(final_data,1)
-        varData = np.var(final_data, 1)
-        self.emit(QtCore.SIGNAL('TimeTraces'), final_data)
-        self.emit(QtCore.SIGNAL('varData'), varData)
-        self.emit(QtCore.SIGNAL('MeanData'), mean_data)  # For updating values in an external dialog
+    def updateVariances(self, variances):
+        """Updates the plots of the variances.
+        variances -- array with the time in the first row and one row per device, see monitorThread.
+        """
+        for i,curve in enumerate(self.varCurves):
+            curve.setData(variances[0],variances[i+1])
 
-    def updateTimes(self,data):
-        """Updates the plots of the timetraces.
+    def resizeEvent(self,event):
+        """The timetraces are decimated to the width of the plots.
         """
-        #Check the sizes of the variances
-        var = copy.copy(data)
-        for i in range(len(var)):
-            xdata = np.arange(len(var[i]))*self._session.monitorTimeresol/1000
-            old_data = self.data[i]
-            old_t = self.t[i]
-            self.t[i] = np.append(self.t[i], xdata+max(self.t[i]) + self._session.monitorTimeresol/1000)
-            self.data[i] = np.append(self.data[i],var[i])
-            limit = int(self._session.monitorTime/self._session.monitorTimeresol*1000)
-            if self.firstMon[i]:
-                limit = len(self.t[i])-1
-                self.firstMon[i] = False
-            self.t[i] = self.t[i][-limit:]
-            self.data[i] = self.data[i][-limit:]
-
-        self.qpdx.setData(self.t[0],self.data[0])
-        self.qpdy.setData(self.t[1],self.data[1])
-        self.qpdz.setData(self.t[2],self.data[2])
-
-    def updateVariances(self, data):
-        var = copy.copy(data)
-        for i in range(len(var)):
-            xdata = self._session.monitorRefresh/1000
-            self.varT[i] = np.append(self.varT[i], xdata + max(self.varT[i]) + self._session.monitorRefresh/1000)
-            self.varData[i] = np.append(self.varData[i], var[i])
-            limit = int(self._session.monitorTime/self._session.monitorRefresh*1000)
-            if self.firstVar[i]:
-                limit = len(self.varT[i])-1
-                self.firstVar[i] = False
-            self.varT[i] = self.varT[i][-limit:]
-            self.varData[i] = self.varData[i][-limit:]
-
-        self.varx.setData(self.varT[0], self.varData[0])
-        self.vary.setData(self.varT[1], self.varData[1])
-        self.varz.setData(self.varT[2], self.varData[2])
+        super(mainWindow,self).resizeEvent(event)
+        if hasattr(self,'monitor') and self.timetraces.traces:
+            self.monitor.pixels = self.timetraces.traces[0].width()
+
+    def monitorError(self,error):
+        """Stops the monitor if reading the card failed.
+        """
+        self.stop_timer()
+        self.statusBar().showMessage('Monitor stopped: %s'%error)
 
     def start_timer(self):
-        """Starts the timer with a predefined update interval.
-        It also starts the monitor routine.
+        """Starts the monitor routine and the thread that reads it every monitorRefresh ms.
         """
         if not self.running:
             if self.powerSpectra.is_running:
                 print('Cant update while power spectra is running.')
             else:
                 conditions = {}
-                # Starts the timer for updating the GUI
                 conditions['devs'] = self.devices
                 conditions['accuracy'] = self._session.monitorTimeresol/1000 # In seconds
                 self.trap.startMonitor(conditions)
-                self.ctimer.start(self._session.monitorRefresh)
+                self.monitor.start()
 
                 self.running = True
         else:
@@ -217,7 +184,7 @@ class mainWindow(QtGui.QMainWindow):
     def stop_timer(self):
         """Stops refreshing and the monitor.
         """
-        self.ctimer.stop()
+        self.monitor.stop()
         if self.running:
             self.trap.stopMonitor()
         self.running = False
@@ -231,30 +198,45 @@ class mainWindow(QtGui.QMainWindow):
             os.makedirs(savedir)
         i=1
         filename = name
-        while os.path.exists(os.path.join(savedir,filename+".dat")):
+        while os.path.exists(os.path.join(savedir,filename+tracefile.extension)) or \
+                self.writer.isPending(os.path.join(savedir,filename+tracefile.extension)):
             filename = '%s_%s' %(name,i)
             i += 1
 
-        filename = filename+".dat"
-        np.savetxt(os.path.join(savedir, filename), [self.t, self.data], fmt='%s', delimiter=",")
-
-        # Saves the data to binary format. Sometimes (not sure why) the ascii data is not being save properly...
-        # Only what would appear on the screen when printing self.data.
+        filename = os.path.join(savedir,filename+tracefile.extension)
+        data = self.monitor.latestTraces() # A copy, the ring buffer keeps changing. The first row is the time
+        metadata = {'time0':float(data[0,0]) if data.shape[1] else 0, # Time of the first point, in seconds
+                    'devices':tracefile.deviceParameters(self.devices),
+                    'session':tracefile.sessionParameters(self._session)}
+        names = [dev.properties.get('Name','') for dev in self.devices]
         try:
-            np.save(os.path.join(savedir, filename[:-4]), np.array(self.data))
-        except:
-            print('Error with Save')
-            print(sys.exc_info()[0])
-
-        print('Data saved in %s'%os.path.join(savedir, filename[:-4])) 
+            self.writer.save(filename,tracefile.writeTrace,data[1:],self._session.monitorTimeresol/1000,names,metadata,
+                             compression=self._session.traceCompression)
+        except Exception as e:
+            self.statusBar().showMessage('%s'%e)
+            return
+        self.statusBar().showMessage('Saving %s...'%filename)
         return
 
+    def saved(self,filename,error):
+        """Called when a file was written, or failed to be written.
+        """
+        if error is None:
+            self.statusBar().showMessage('Data saved in %s'%filename)
+            print('Data saved in %s'%filename)
+        else:
+            self.statusBar().showMessage('Error saving %s: %s'%(filename,error))
+            print('Error saving %s: %s'%(filename,error))
+
     def updateParameters(self,_session):
         """Updates the relevant parameters for the monitor timetrace.
         """
         self._session = _session
         self.powerSpectra._session = _session
         self.configWindow._session = _session
+        self.monitor._session = _session
+        self.scheduler.setFps(_session.monitorFps)
+        fftbackend.setBackend(fftbackend.backend,_session.fftWorkers)
         self.stop_timer()
         self.start_timer()
 
@@ -269,10 +251,142 @@ class mainWindow(QtGui.QMainWindow):
         self.powerSpectra.exit_safe()
         self.configWindow.close()
         self.stop_timer()
+        self.scheduler.stop()
         self.trap.stopMonitor()
+        self.trap.releaseTasks()
+        self.writer.flush() # The files queued are written before exiting
         self.close()
 
 
+class monitorThread(QtCore.QThread):
+    """ Reads the monitor of the trap every monitorRefresh ms and prepares the data for plotting.
+        The timetraces and the variances are kept in ring buffers of fixed size. The first row of every buffer
+        holds the time and the rest one row per device. For plotting they are reduced to the minimum and maximum
+        of groups of points (see envelopeBuffer), about two points per pixel of the plots, therefore the cost of
+        drawing does not depend on monitorTime. The signals carry copies of the decimated traces, about two points
+        per pixel and channel, because the GUI draws them while the thread is already writing the next points.
+        The mean and variance of every refresh are merged with runningStats from the blocks of monitorBlock ms
+        in which the card is read.
+    """
+    def __init__(self,_session,trap,channels):
+        QtCore.QThread.__init__(self)
+        self._session = _session
+        self.trap = trap
+        self.channels = channels
+        self.pixels = 1000 # Width of the plots, set by the GUI
+        self.stats = runningStats(channels)
+        self.tracesLock = threading.Lock() # The timetraces are copied by the GUI while the thread writes them
+        self.keepRunning = False
+        self.clearing = False
+        self.resetBuffers()
+
+    def __del__(self):
+        self.wait()
+
+    def traceCapacity(self):
+        """Number of points of the timetraces displayed, monitorTime/monitorTimeresol.
+        """
+        return int(self._session.monitorTime/self._session.monitorTimeresol*1000)
+
+    def varianceCapacity(self):
+        """Number of variances displayed, monitorTime/monitorRefresh.
+        """
+        return int(self._session.monitorTime/self._session.monitorRefresh*1000)
+
+    def resetBuffers(self):
+        with self.tracesLock:
+            self.traces = ringBuffer(self.channels+1,self.traceCapacity())
+        self.variances = ringBuffer(self.channels+1,self.varianceCapacity())
+        self.tracesEnvelope = envelopeBuffer(self.channels+1,self.traceCapacity(),self.pixels)
+        self.variancesEnvelope = envelopeBuffer(self.channels+1,self.varianceCapacity(),self.pixels)
+        self.lastTime = 0 # Time of the last point of the timetraces, in seconds
+        self.lastVarTime = 0 # Time of the last variance, in seconds
+        self.clearing = False
+
+    def clear(self):
+        """ Forgets the data displayed. If the thread is running, it is done before the next read.
+        """
+        if self.isRunning():
+            self.clearing = True
+        else:
+            self.resetBuffers()
+
+    def latestTraces(self):
+        """ Returns a copy of the timetraces displayed, the first row is the time.
+            It is taken while the thread is not writing, so it never holds a block written only in part.
+        """
+        with self.tracesLock:
+            return np.array(self.traces.latest(self.traceCapacity()))
+
+    def run(self):
+        self.keepRunning = True
+        while self.keepRunning:
+            self.msleep(int(self._session.monitorRefresh))
+            if self.clearing:
+                self.resetBuffers()
+            try:
+                data = self.trap.readMonitor() # Array of shape (channels, points)
+            except Exception as e:
+                self.keepRunning = False
+                self.emit(QtCore.SIGNAL('MonitorError'), '%s'%e)
+                return
+            if data.shape[1] == 0:
+                continue
+            # The statistics of the refresh are merged from the blocks in which the card is read
+            blockPoints = max(int(self._session.monitorBlock/self._session.monitorTimeresol),1)
+            self.stats.reset()
+            for start in range(0,data.shape[1],blockPoints):
+                self.stats.update(data[:,start:start+blockPoints])
+            stats = self.stats.get()
+            self.emit(QtCore.SIGNAL('TimeTraces'), self.addTraces(data))
+            self.emit(QtCore.SIGNAL('varData'), self.addVariances(stats['var']))
+            self.emit(QtCore.SIGNAL('MeanData'), stats['mean'])  # For updating values in an external dialog
+
+    def updateEnvelope(self,buffer,envelope,capacity):
+        """ Adapts the ring buffer and its envelope to the capacity and to the width of the plots.
+            Returns the buffer and the envelope to use.
+        """
+        if buffer.capacity != capacity:
+            buffer = buffer.resized(capacity)
+        if envelope.points != capacity or envelope.pixels != max(int(self.pixels),1):
+            envelope = envelopeBuffer(buffer.channels,capacity,self.pixels)
+            envelope.write(buffer.latest(capacity))
+        return buffer,envelope
+
+    def addTraces(self,data):
+        """ Appends the points read to the timetraces and returns a copy of the decimated traces to plot.
+        """
+        points = data.shape[1]
+        block = np.empty((self.traces.channels,points))
+        block[0] = self.lastTime+self._session.monitorTimeresol/1000*np.arange(1,points+1)
+        block[1:] = data
+        with self.tracesLock:
+            self.traces,self.tracesEnvelope = self.updateEnvelope(self.traces,self.tracesEnvelope,
+                                                                  self.traceCapacity())
+            self.traces.write(block)
+        self.tracesEnvelope.write(block)
+        self.lastTime = block[0,-1]
+        return np.array(self.tracesEnvelope.latest())
+
+    def addVariances(self,var):
+        """ Appends the variance of the last refresh and returns a copy of the decimated variances to plot.
+        """
+        self.variances,self.variancesEnvelope = self.updateEnvelope(self.variances,self.variancesEnvelope,
+                                                                    self.varianceCapacity())
+        block = np.empty((self.variances.channels,1))
+        block[0] = self.lastVarTime+self._session.monitorRefresh/1000
+        block[1:,0] = var
+        self.variances.write(block)
+        self.variancesEnvelope.write(block)
+        self.lastVarTime = block[0,0]
+        return np.array(self.variancesEnvelope.latest())
+
+    def stop(self):
+        """ Stops reading the monitor after the current refresh.
+        """
+        self.keepRunning = False
+        self.wait()
+
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
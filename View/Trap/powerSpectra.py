@@ -3,7 +3,9 @@ Created on 18 sep. 2015
 
 @author: carattino
 '''
-import sys, os
+import os
+import time
+import threading
 import numpy as np
 import pyqtgraph as pg
 from datetime import datetime
@@ -13,6 +15,12 @@ from matplotlib.backend_bases import CloseEvent
 
 from Model.trap import Trap
 from Model._session import _session
+from Model.rawtrace import rawTrace
+from Model.spectra import welch, welchReader, psdAverager, logBin, segmentCount
+from Model import tracefile
+from Model.savewriter import saveWriter
+from Model.archive import runArchive
+from Model.calibration import calibrate, aliasedLorentzian, lorentzian
 
 class powerSpectra(QtGui.QMainWindow):
     """ Main window for holding the Power Spectra widget.
@@ -23,7 +31,7 @@ class powerSpectra(QtGui.QMainWindow):
         # Layout
         self.setWindowTitle('Power Spectra')
         self.setGeometry(30,30,900,900)
-        self.timetraces = PowerSpectraWidget()
+        self.timetraces = PowerSpectraWidget(_session.highSpeedDevs)
         self.setCentralWidget(self.timetraces)
 
         self._session = _session
@@ -36,23 +44,30 @@ class powerSpectra(QtGui.QMainWindow):
 
         num_points = int(self.time/self.accuracy)
         freqs = np.fft.rfftfreq(num_points, self.accuracy)
-        initial_data = np.random.normal(size=(num_points))
-        initial_ps = np.abs(np.fft.rfft(initial_data))**2
 
         self.freqs = freqs
         self.num_points = num_points
+        self.data = None
 
-        self.curvex = self.timetraces.px.plot(freqs,initial_ps,pen='y')
-        self.curvey = self.timetraces.py.plot(freqs,initial_ps,pen='y')
-        self.curvez = self.timetraces.pz.plot(freqs,initial_ps,pen='y')
+        self.buildCurves()
+        self.binned = None # Displayed spectra: frequencies, values and number of points of every bin, see logBin
+        self.calibration = None # Result of the last fit, see Model.calibration.calibrate
 
         self.connect(QtGui.QShortcut(QtGui.QKeySequence(QtCore.Qt.Key_S), self), QtCore.SIGNAL('activated()'), self.fileSave)
 
         self.workThread = workThread(self._session,self.trap)
         self.connect(self.workThread, QtCore.SIGNAL("QPD"), self.updateGUI )
         self.connect(self.workThread,  QtCore.SIGNAL('Stop_Tr'), self.stop_tr)
+        self.connect(self.workThread,  QtCore.SIGNAL('finished()'), self.thread_finished)
         self.setStatusTip('Running...')
         self.is_running = False # Status of the thread
+        self.averager = psdAverager() # Average of the spectra of consecutive runs
+        # The files are written in the background
+        self.writer = saveWriter(callback=lambda filename,error: self.emit(QtCore.SIGNAL('Saved'),filename,error))
+        self.connect(self, QtCore.SIGNAL('Saved'), self.saved)
+        # The runs are archived by their own writer, only the errors are reported
+        self.archive = None
+        self.archiveWriter = saveWriter(maxQueue=4,callback=self.archived)
 
         ##################
         # Build the menu #
@@ -76,6 +91,28 @@ class powerSpectra(QtGui.QMainWindow):
         stopTimetrace.setStatusTip('Stops the acquisition after the current')
         stopTimetrace.triggered.connect(self.stop_acq)
 
+        self.averageAction = QtGui.QAction('Average runs',self)
+        self.averageAction.setCheckable(True)
+        self.averageAction.setShortcut('Ctrl+A')
+        self.averageAction.setStatusTip('Displays the average of the spectra of all the runs')
+        self.averageAction.triggered.connect(self.reset_average)
+
+        self.fitAction = QtGui.QAction('Fit Lorentzian',self)
+        self.fitAction.setCheckable(True)
+        self.fitAction.setShortcut('Ctrl+F')
+        self.fitAction.setStatusTip('Calibrates the trap fitting a Lorentzian to the spectra of every run')
+        self.fitAction.triggered.connect(self.fit)
+
+        self.archiveAction = QtGui.QAction('Archive runs',self)
+        self.archiveAction.setCheckable(True)
+        self.archiveAction.setChecked(self._session.archiveRuns)
+        self.archiveAction.setStatusTip('Stores every run in a rolling archive')
+        self.archiveAction.triggered.connect(self.toggle_archive)
+
+        resetAverage = QtGui.QAction('Reset average',self)
+        resetAverage.setStatusTip('Starts the average of the spectra again')
+        resetAverage.triggered.connect(self.reset_average)
+
         #self.statusBar()
         menubar = self.menuBar()
         fileMenu = menubar.addMenu('&File')
@@ -84,10 +121,28 @@ class powerSpectra(QtGui.QMainWindow):
         powerMenu = menubar.addMenu('&Power Spectra')
         powerMenu.addAction(triggerTimetrace)
         powerMenu.addAction(stopTimetrace)
+        powerMenu.addAction(self.averageAction)
+        powerMenu.addAction(resetAverage)
+        powerMenu.addAction(self.fitAction)
+        powerMenu.addAction(self.archiveAction)
 
         self.statusbar = QtGui.QStatusBar()
         self.setStatusBar(self.statusbar)
 
+    def buildCurves(self):
+        """ Creates the curves of the spectra, their envelopes and their fits, one per device of highSpeedDevs,
+            in the plots of the same order.
+        """
+        self.devices = list(self._session.highSpeedDevs)
+        self.timetraces.setDevices(self.devices)
+        self.curves = []
+        self.envelopes = [] # Minimum and maximum of every bin, only displayed if _session.psdEnvelope is True
+        self.fits = [] # Lorentzian fitted to every spectrum, only displayed if the fit is activated
+        for p in self.timetraces.plots:
+            self.curves.append(p.plot([],[],pen='y'))
+            self.envelopes.append((p.plot([],[],pen=(120,120,0)),p.plot([],[],pen=(120,120,0))))
+            self.fits.append(p.plot([],[],pen='r'))
+
     def stop_tr(self):
         """ Emmits a signal for stopping the timetraces.
         """
@@ -97,7 +152,7 @@ class powerSpectra(QtGui.QMainWindow):
         """ Stops the continuous runs.
             Emmits a signal for continuing with the timetraces.
         """
-        _session.runs = False
+        self._session.runs = False
         self.emit(QtCore.SIGNAL('Start_Tr'))
 
     def update(self):
@@ -112,51 +167,195 @@ class powerSpectra(QtGui.QMainWindow):
         else:
             print('Try to re-run')
 
-    def updateGUI(self,frequencies,data,values):
+    def updateGUI(self,frequencies,data,values,pipelined=False):
         """Updates the curves in the screen and the mean values.
+        pipelined -- True if the run is part of pipelined continuous runs that go on after it. It is sent with the
+            data because the working thread may have finished the runs by the time the data is displayed.
         """
-        self.setStatusTip('Stopped...')
-        self.is_running = False
+        if not pipelined:
+            self.setStatusTip('Stopped...')
+            self.is_running = False
+        previous = self.data
         self.data = data
+        self.workThread.release(previous) # The working thread can reuse the buffer of the previous data
+        if self._session.archiveRuns:
+            self.archiveRun(data,frequencies,values)
+        if list(self._session.highSpeedDevs) != self.devices:
+            # The devices changed, the spectra of the previous ones can not be averaged with the new ones
+            self.buildCurves()
+            self.averager.reset()
         self.freqs = frequencies
-        self.curvex.setData(self.freqs[1:],values[1,1:])
-        self.curvey.setData(self.freqs[1:],values[0,1:])
-        self.curvez.setData(self.freqs[1:],values[2,1:])
-
-        if self._session.runs: # If the continuous runs is activated, then refresh.
+        if self.averageAction.isChecked():
+            count = self.averager.update(frequencies,values[:-1])
+            values = self.averager.mean
+            self.statusbar.showMessage('Averages: %s'%count)
+        if self._session.psdBinsPerDecade > 0:
+            # Most of the points would be on top of each other in the logarithmic axes
+            freqs,values,counts,low,high = logBin(self.freqs,values[:len(self.devices)],self._session.psdBinsPerDecade,
+                                                  self._session.psdEnvelope)
+        else:
+            freqs,values,counts,low,high = self.freqs[1:],values[:len(self.devices),1:],np.ones(len(self.freqs)-1),None,None
+        self.binned = (freqs,values,counts)
+        for curve,v in zip(self.curves,values):
+            curve.setData(freqs,v)
+        for i,env in enumerate(self.envelopes):
+            if low is None:
+                env[0].setData([],[])
+                env[1].setData([],[])
+            else:
+                env[0].setData(freqs,low[i])
+                env[1].setData(freqs,high[i])
+        self.fit()
+
+        if self._session.runs and not pipelined: # If the continuous runs is activated, then refresh.
             self.update()
 
+    def thread_finished(self):
+        """ Called when the working thread finishes. Pipelined runs are not restarted from updateGUI,
+            therefore they are marked as stopped here.
+        """
+        if not self._session.runs:
+            self.setStatusTip('Stopped...')
+            self.is_running = False
+
+
+    def fit(self):
+        """ Fits a Lorentzian to the displayed spectra and shows the calibration of every axis.
+        """
+        if not self.fitAction.isChecked() or self.binned is None:
+            for curve in self.fits:
+                curve.setData([],[])
+            return
+        freqs,values,counts = self.binned
+        # Every bin is the average of the periodograms of all the segments, and of all the runs if averaging
+        counts = counts*segmentCount(np.shape(self.data)[-1],self._session.highSpeedSegment,self._session.highSpeedOverlap)
+        if self.averageAction.isChecked():
+            counts = counts*max(self.averager.count,1)
+        accuracy = self._session.highSpeedAccuracy/1000 # In seconds
+        try:
+            self.calibration = calibrate(freqs,values,counts,accuracy,
+                                         aliasing=self._session.psdFitAliasing,
+                                         filter=self._session.qpdFilter,
+                                         fmin=self._session.psdFitMin,
+                                         fmax=self._session.psdFitMax,
+                                         radius=self._session.beadRadius,
+                                         viscosity=self._session.viscosity,
+                                         temperature=self._session.temperature)
+        except Exception as e:
+            self.statusbar.showMessage('Error fitting the spectra: %s'%e)
+            return
+        c = self.calibration
+        if self._session.psdFitAliasing:
+            model = aliasedLorentzian(freqs,c['fc'],c['D'],accuracy,self._session.qpdFilter)
+        else:
+            model = lorentzian(freqs,c['fc'],c['D'])
+        message = []
+        for i,(curve,name) in enumerate(zip(self.fits,self.devices)):
+            curve.setData(freqs,model[i])
+            message.append('%s: fc=%.1f+-%.1f Hz, k=%.2e N/m'%(name,c['fc'][i],c['fcErr'][i],c['kappa'][i]))
+        self.statusbar.showMessage('; '.join(message))
+
+    def toggle_archive(self):
+        """ Starts or stops archiving every run.
+        """
+        self._session.archiveRuns = self.archiveAction.isChecked()
+
+    def archiveRun(self,data,frequencies,values):
+        """ Queues a run for storing it in the archive of runs. If the archive can not keep up, the run is skipped.
+        """
+        directory = self._session.archiveDirectory or os.path.join(self._session.saveDirectory,'archive')
+        timestamp = time.time()
+        metadata = {'time':self._session.highSpeedTime, # In seconds
+                    'session':tracefile.sessionParameters(self._session)}
+        if isinstance(data,rawTrace):
+            metadata['coefficients'] = data.coefficients.tolist()
+            data = data.raw
+        elif self.workThread.isBuffer(data):
+            data = data.copy() # The buffers of the pipelined runs are filled again
+        psd = (frequencies,values[:-1]) if self._session.archivePsd else None
+        try:
+            self.archiveWriter.save(directory,self.archiveAdd,data,
+                                    self._session.highSpeedAccuracy/1000,list(self._session.highSpeedDevs),
+                                    metadata,psd,timestamp)
+        except Exception:
+            self.statusbar.showMessage('The archive is behind, a run was not archived')
+
+    def archived(self,directory,error):
+        """ Called from the thread of the archive writer after every run. Only the errors are shown.
+        """
+        if error is not None:
+            self.emit(QtCore.SIGNAL('Saved'),directory,error)
+
+    def archiveAdd(self,directory,*args):
+        """ Adds a run to the archive, from the thread of the archive writer. The archive is opened here the first
+            time, or when its directory changes, so an unreachable directory is reported as any other error.
+        """
+        if self.archive is None or self.archive.directory != directory:
+            self.archive = runArchive(directory,self._session.archiveMaxBytes,self._session.archiveMaxAge,
+                                      self._session.archiveCompression)
+        self.archive.add(*args)
+
+    def reset_average(self):
+        """ Starts the average of the spectra again.
+        """
+        self.averager.reset()
+        self.statusbar.showMessage('Averages: 0')
 
     def fileSave(self):
         """Saves the files to a specified folder.
         """
+        if self.data is None:
+            print('No data to save')
+            return
         name = 'PowerSpectra_Data'
         savedir = os.path.join(self._session.saveDirectory, str(datetime.now().date()))
         if not os.path.exists(savedir):
             os.makedirs(savedir)
         i=1
         filename = name
-        while os.path.exists(os.path.join(savedir,filename+".dat")):
+        while os.path.exists(os.path.join(savedir,filename+tracefile.extension)) or \
+                self.writer.isPending(os.path.join(savedir,filename+tracefile.extension)):
             filename = '%s_%s' %(name,i)
             i += 1
 
-        filename_params = filename + '_config.dat'
-        filename = filename+".dat"
-        np.savetxt(os.path.join(savedir,filename), self.data,fmt='%s', delimiter=",")
-
-        header = "Length (s), Integration Time (ms)"
-        np.savetxt(os.path.join(savedir,filename_params), [self._session.highSpeedTime, self._session.highSpeedAccuracy], header=header,fmt='%s',delimiter=',')
-
-        # Saves the data to binary format. Sometimes (not sure why) the ascii data is not being save properly...
-        # Only what would appear on the screen when printing self.data.
+        filename = os.path.join(savedir,filename+tracefile.extension)
+        devices = [self._session.devs[n] for n in self._session.highSpeedDevs]
+        metadata = {'time':self._session.highSpeedTime, # In seconds
+                    'devices':tracefile.deviceParameters(devices),
+                    'session':tracefile.sessionParameters(self._session)}
+        data = self.data
+        if isinstance(data,rawTrace):
+            # The raw values of the card are stored, with the coefficients for converting them to volts
+            metadata['coefficients'] = data.coefficients.tolist()
+            data = data.raw
+        if self.workThread.isBuffer(data):
+            data = data.copy() # The buffers of the pipelined runs are filled again, the rest of the data is not changed
         try:
-            np.save(os.path.join(savedir,filename_params[:-4]), np.array(self.data))
-        except:
-            print('Error with Save')
-            print(sys.exc_info()[0])
-        print('Data saved in %s and configuration data in %s' % os.path.join(savedir,filename_params[:-4]) )
+            self.writer.save(filename,tracefile.writeTrace,data,self._session.highSpeedAccuracy/1000,
+                             list(self._session.highSpeedDevs),metadata,compression=self._session.traceCompression)
+            # Saves the averaged spectra: frequencies, the mean of every channel and, if available, their variance.
+            if self.averager.count > 0:
+                averaged = [self.averager.freqs[np.newaxis,:],self.averager.mean]
+                if self.averager.var is not None:
+                    averaged.append(self.averager.var)
+                self.writer.save(filename[:-len(tracefile.extension)]+'_psd_%s_averages.npy'%self.averager.count,
+                                 np.save,np.vstack(averaged))
+        except Exception as e:
+            self.statusbar.showMessage('%s'%e)
+            return
+        self.statusbar.showMessage('Saving %s...'%filename)
         return
 
+    def saved(self,filename,error):
+        """ Called when a file was written, or failed to be written.
+        """
+        if error is None:
+            self.statusbar.showMessage('Data saved in %s'%filename)
+            print('Data saved in %s' % filename)
+        else:
+            self.statusbar.showMessage('Error saving %s: %s'%(filename,error))
+            print('Error saving %s: %s'%(filename,error))
+
     def exit_safe(self):
         """ Exits the application stopping the working Thread.
         """
@@ -165,6 +364,8 @@ class powerSpectra(QtGui.QMainWindow):
             print('Waiting for the acquisition to finish.')
             print('It may take up to %s more seconds.'%_session.highSpeedTime)
         self.workThread.terminate()
+        self.writer.flush() # The files queued are written before exiting
+        self.archiveWriter.flush()
         self.close()
 
     def closeEvent(self,evnt):
@@ -174,90 +375,133 @@ class powerSpectra(QtGui.QMainWindow):
 
 class PowerSpectraWidget(QtGui.QWidget):
     """ Class for starting the needed windows and updating the screen.
+        It holds one plot of the power spectrum per device, in a grid of two columns.
     """
-    def __init__(self,parent=None):
+    def __init__(self,devices,parent=None):
+        """devices -- list with the names of the devices, in the order of the spectra.
+        """
         QtGui.QWidget.__init__(self, parent)
 
         self.setWindowTitle('QPD Power Spectrum')
 
         self.layout = QtGui.QGridLayout(self)
+        self.plots = []
+        self.setDevices(devices)
 
-        """ Power Spectrum """
-        px = pg.PlotWidget()
-        py = pg.PlotWidget()
-        pz = pg.PlotWidget()
-
-
-        self.layout.addWidget(px, 0, 0)
-        self.layout.addWidget(py, 0, 1)
-        self.layout.addWidget(pz, 1, 0)
-
-        px.setLabel('left', "Power Spectrum X", units='U.A.')
-        px.setLabel('bottom', "Frequency", units='Hz')
-        px.setLogMode(x=True, y=True)
-
-        py.setLabel('left', "Power Spectrum Y", units='U.A.')
-        py.setLabel('bottom', "Frequency", units='Hz')
-        py.setLogMode(x=True, y=True)
-
-        pz.setLabel('left', "Power Spectrum Z", units='U.A.')
-        pz.setLabel('bottom', "Frequency", units='Hz')
-        pz.setLogMode(x=True, y=True)
-
-        px.enableAutoRange('xy', True)
-        py.enableAutoRange('xy', True)
-        pz.enableAutoRange('xy', True)
-
-        self.px = px
-        self.py = py
-        self.pz = pz
+    def setDevices(self,devices):
+        """ Creates the plots of the devices, replacing the previous ones.
+        """
+        for p in self.plots:
+            self.layout.removeWidget(p)
+            p.deleteLater()
+        self.plots = []
+        for i,name in enumerate(devices):
+            """ Power Spectrum """
+            p = pg.PlotWidget()
+            self.layout.addWidget(p, i//2, i%2)
+            p.setLabel('left', "Power Spectrum %s"%name, units='V^2/Hz')
+            p.setLabel('bottom', "Frequency", units='Hz')
+            p.setLogMode(x=True, y=True)
+            p.enableAutoRange('xy', True)
+            self.plots.append(p)
 
 class workThread(QtCore.QThread):
     def __init__(self,_session,trap):
         QtCore.QThread.__init__(self)
         self._session = _session
         self.trap = trap
+        self.pipelined = False # True while running pipelined continuous runs
+        self.buffers = []
+        self.free = None
     def __del__(self):
         self.wait()
 
     def run(self):
         """ Triggers the ADwin to acquire a new set of data. It is a time consuming task.
         """
-        num_points = int(self._session.highSpeedTime/self._session.highSpeedAccuracy*1000)
-        freqs = np.fft.rfftfreq(num_points,self._session.highSpeedAccuracy/1000)
-
         """ Need to stop the monitor?
             If the monitor changes the position of the multiplexor, then it will
             alter the timing between the measurements.
         """
         self.emit(QtCore.SIGNAL('Stop_Tr'))
 
-        """ Have to assume a particular order of the devices, i.e. QPDx->QPDy->QPDz"""
-        dev = [self._session.devs['qpdx'],self._session.devs['qpdy'],self._session.devs['qpdz']]
+        """ The spectra are displayed in the order of the devices of highSpeedDevs"""
+        dev = [self._session.devs[name] for name in self._session.highSpeedDevs]
 
         conditions = {}
         conditions['devs'] = dev
         conditions['time']  = self._session.highSpeedTime
         conditions['accuracy'] = self._session.highSpeedAccuracy
+        conditions['simultaneous'] = self._session.highSpeedSimultaneous
+        conditions['raw'] = self._session.highSpeedRaw
+        if self._session.runs and self._session.highSpeedPipeline and conditions['simultaneous'] and not conditions['raw']:
+            self.runPipelined(conditions)
+            return
         fastData = self.trap.fastTimetrace(conditions)
-        pwrx = np.abs(np.fft.rfft(fastData[0]))**2
-        pwry = np.abs(np.fft.rfft(fastData[1]))**2
-        pwrz = np.abs(np.fft.rfft(fastData[2]))**2
-
-        values = np.zeros([4,len(pwrx)])
-        data = np.zeros([3,len(fastData[0])])
-        values[0,:] = pwrx
-        values[1,:] = pwry
-        values[2,:] = pwrz
-        values[3,0] = np.mean(fastData[0])
-        values[3,1] = np.mean(fastData[1])
-        values[3,2] = np.mean(fastData[2])
-        data[0,:] = fastData[0]
-        data[1,:] = fastData[1]
-        data[2,:] = fastData[2]
-
-        self.emit( QtCore.SIGNAL('QPD'), freqs, fastData, values)
+        self.process(fastData)
         return
 
+    def runPipelined(self,conditions):
+        """ Continuous runs in which the card acquires the next timetrace while the previous one is transformed
+            and displayed. Two buffers are used alternately; a buffer is only reused once the GUI released it,
+            i.e. once it received newer data (see release).
+        """
+        self.pipelined = True
+        points = int(conditions['time']*1000/conditions['accuracy'])
+        channels,limits = self.trap.analogChannels(conditions['devs'])
+        self.buffers = [np.zeros((len(channels),points)) for i in range(2)]
+        self.free = threading.Semaphore(2)
+        i = 0
+        self.free.acquire()
+        self.trap.triggerFastTimetrace(conditions)
+        current = self.trap.readFastTimetrace(conditions,self.buffers[i])
+        while self._session.runs:
+            self.trap.triggerFastTimetrace(conditions) # The card acquires the next timetrace in the background
+            self.process(current)
+            i = 1-i
+            self.free.acquire() # Waits until the GUI does not use the buffer anymore
+            current = self.trap.readFastTimetrace(conditions,self.buffers[i])
+        self.pipelined = False
+        self.process(current)
+
+    def release(self,data):
+        """ Called by the GUI when it does not use data anymore. If it is one of the buffers of the
+            pipelined runs, the buffer can be filled again.
+        """
+        if data is None or self.free is None:
+            return
+        if self.isBuffer(data):
+            self.free.release()
+
+    def isBuffer(self,data):
+        """ True if data is one of the buffers of the pipelined runs, i.e. it is going to be filled again.
+        """
+        return any(data is b or getattr(data,'base',None) is b for b in self.buffers)
+
+    def process(self,fastData):
+        """ Computes the power spectra of the timetrace and sends them to the GUI.
+        """
+        if isinstance(fastData,rawTrace):
+            # The raw data is converted to volts block by block, never as a whole
+            freqs,psd,means = welchReader(fastData,nperseg=self._session.highSpeedSegment,
+                                          overlap=self._session.highSpeedOverlap,
+                                          window=self._session.highSpeedWindow,
+                                          fastLength=self._session.fftLength,mean=True)
+        else:
+            traces = np.asarray(fastData)
+            freqs,psd = welch(traces,self._session.highSpeedAccuracy/1000,
+                              nperseg=self._session.highSpeedSegment,
+                              overlap=self._session.highSpeedOverlap,
+                              window=self._session.highSpeedWindow,
+                              fastLength=self._session.fftLength)
+            means = np.mean(traces,1)
+        # One row per device and, in the last row, the mean of every device
+        channels = psd.shape[0]
+        values = np.zeros([channels+1,len(freqs)])
+        values[:channels,:] = psd
+        values[channels,:channels] = means
+
+        self.emit( QtCore.SIGNAL('QPD'), freqs, fastData, values, self.pipelined)
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,79 @@
+'''
+Schedules the redraws of the different views of the GUI.
+
+The data arrives from the worker threads faster than it is useful to draw it. The scheduler keeps only the latest
+data sent to every view and draws it at most maxFps times per second. If drawing takes longer than the data takes
+to arrive, the intermediate data is never drawn. Views whose window is hidden or minimized are not drawn at all;
+their latest data is drawn when they are shown again.
+'''
+import time
+from pyqtgraph.Qt import QtCore
+
+
+class renderScheduler(QtCore.QObject):
+    """ Coalesces the redraws of several views and limits their frame rate.
+    """
+    def __init__(self,maxFps=30,parent=None):
+        """maxFps -- default maximum number of redraws per second of every view.
+        """
+        QtCore.QObject.__init__(self,parent)
+        self.maxFps = maxFps
+        self.views = {}
+        self.timer = QtCore.QTimer()
+        QtCore.QObject.connect(self.timer,QtCore.SIGNAL("timeout()"),self.render)
+
+    def register(self,name,widget,draw,maxFps=None):
+        """Adds a view.
+        name -- name used for submitting data to the view.
+        widget -- the widget where the view is drawn. It is not drawn while it is not visible.
+        draw -- function that draws the view; it is called with the arguments given to submit.
+        maxFps -- maximum number of redraws per second of this view. If None, the default of the scheduler.
+        """
+        self.views[name] = {'widget':widget,'draw':draw,'maxFps':maxFps or self.maxFps,
+                            'pending':None,'last':0}
+        self.startTimer()
+
+    def setFps(self,maxFps):
+        """Changes the maximum number of redraws per second of all the views.
+        """
+        self.maxFps = maxFps
+        for view in self.views.values():
+            view['maxFps'] = maxFps
+        self.startTimer()
+
+    def startTimer(self):
+        """The timer runs at the frame rate of the fastest view.
+        """
+        fastest = max(v['maxFps'] for v in self.views.values())
+        self.timer.start(int(1000/fastest))
+
+    def submit(self,name,*args):
+        """Sends new data to a view. If the previous data was not drawn yet, it is replaced.
+        """
+        self.views[name]['pending'] = args
+
+    def isShown(self,widget):
+        """True if the widget can be seen, i.e. it is visible and its window is not minimized.
+        """
+        return widget.isVisible() and not widget.window().isMinimized()
+
+    def render(self):
+        """Draws the views with new data, respecting their frame rate.
+        """
+        now = time.time()
+        for view in self.views.values():
+            if view['pending'] is None or now-view['last'] < 1./view['maxFps']:
+                continue
+            if not self.isShown(view['widget']):
+                continue
+            args = view['pending']
+            view['pending'] = None
+            view['draw'](*args)
+            end = time.time()
+            period = 1./view['maxFps']
+            # If drawing is slower than the frame rate, the next frame waits at least as long as this one took,
+            # so that the GUI is not busy only drawing
+            view['last'] = now if end-now < period else 2*end-now-period
+
+    def stop(self):
+        self.timer.stop()
@@ -1,12 +1,13 @@
 """Run this program to start the GUI for controlling the optical tweezer
+Starting it with the --sim argument replaces the NI card by a simulated one.
 """
 import os
 import sys
-from Controller.devices.ni6251 import niDAQ
 from Model._session import _session
 from Model.trap import Trap
 from View.Trap.mainWindow import mainWindow
 from Model.lib.xml2dict import device
+from Model import fftbackend
 
 from PyQt4.Qt import QApplication
 
@@ -16,16 +17,23 @@ base_dir = os.path.abspath(os.path.dirname(__file__))
 _session.dev_conf = os.path.join(base_dir,'config','config_devices.xml')
 _session.task_conf = os.path.join(base_dir,'config','config_tasks.yml')
 _session.adq['dev'] = device(type='',name='NI',filename=_session.dev_conf)
-_session.adq['adq'] = niDAQ(device_number=_session.adq['dev'].properties['device_number'])
-_session.adq['type'] = 'ni'
+if '--sim' in sys.argv:
+    from Controller.devices.simulated import simDAQ
+    _session.adq['adq'] = simDAQ(device_number=_session.adq['dev'].properties['device_number'])
+    _session.adq['type'] = 'sim'
+else:
+    from Controller.devices.ni6251 import niDAQ
+    _session.adq['adq'] = niDAQ(device_number=_session.adq['dev'].properties['device_number'])
+    _session.adq['type'] = 'ni'
 
 _session.saveDirectory = 'G:\\Data\\'
+fftbackend.setBackend(fftbackend.backend,_session.fftWorkers)
 
-qpdx = device('qpdx')
-qpdy = device('qpdy')
-qpdz = device('qpdz')
-_session.monDevs = {'qpdx':qpdx,'qpdy':qpdy,'qpdz':qpdz}
-_session.devs = {'qpdx':qpdx,'qpdy':qpdy,'qpdz':qpdz}
+# All the devices of the configuration file are loaded, the analog ones are monitored
+for name in device(type='NI',filename=_session.dev_conf).properties:
+    _session.devs[name] = device(name,filename=_session.dev_conf)
+    if _session.devs[name].properties['Type'] == 'Analog':
+        _session.monDevs[name] = _session.devs[name]
 
 trap = Trap(_session)
 